@@ -0,0 +1,100 @@
+"""Memory per idle connection benchmark.
+
+Opens idle connections from a child process to a ClickerServer running in
+this process and reports how much the memory of the server grew per
+connection: the Python heap (tracemalloc) and the resident memory (Linux
+only). The memory of the sockets in the kernel is not included. Exits with a
+non-zero status if the heap per connection exceeds the target:
+
+    python benchmarks/connection_memory.py --connections 10000
+"""
+
+import gc
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import click
+
+from ece312_clicker.server import ClickerServer
+from ece312_clicker.server_messaging import ServerMessaging
+
+
+"""Target Python heap per idle connection in bytes."""
+TARGET = 4096
+
+CLIENT = '''
+import resource, socket, sys
+soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+host, port, count = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+sockets = [socket.create_connection((host, port)) for _ in range(count)]
+print('ready', flush=True)
+sys.stdin.read()
+'''
+
+
+def resident_memory():
+    """Return the resident memory of this process in bytes or None."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise RuntimeError('Timed out')
+        time.sleep(0.01)
+
+
+@click.command(help='Measure the memory of the clicker server per idle connection.')
+@click.option('--connections', default=2000, help='Number of idle connections.')
+def main(connections):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    server_messaging = ServerMessaging(synchronous=True)
+    for subject in ('connected', 'disconnected', 'received'):
+        server_messaging.gui_register_callbacks(subject, lambda message: None)
+
+    server = ClickerServer('localhost', 0, server_messaging)
+    host, port = server.server_address
+
+    tracemalloc.start()
+    gc.collect()
+    heap_before = tracemalloc.get_traced_memory()[0]
+    rss_before = resident_memory()
+
+    client = subprocess.Popen(
+        [sys.executable, '-c', CLIENT, host, str(port), str(connections)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        client.stdout.readline()
+        wait_for(lambda: server.connected_clients_count() == connections, 60)
+
+        gc.collect()
+        heap = (tracemalloc.get_traced_memory()[0] - heap_before) / connections
+        rss_after = resident_memory()
+    finally:
+        client.stdin.close()
+        client.wait()
+        server.stop()
+
+    print('Idle connections:     {}'.format(connections))
+    print('Heap per connection:  {:.0f} B (target {} B)'.format(heap, TARGET))
+    if rss_before is not None:
+        print('RSS per connection:   {:.0f} B'.format(
+            (rss_after - rss_before) / connections))
+
+    sys.exit(0 if heap <= TARGET else 1)
+
+
+if __name__ == '__main__':
+    main()
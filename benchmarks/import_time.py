@@ -0,0 +1,63 @@
+"""Import time benchmark.
+
+Measures the import time of the entry points with `python -X importtime` in
+fresh interpreters and compares the median to the target of each entry point.
+Exits with a non-zero status if any of the targets is exceeded, so it can be
+used as a regression check:
+
+    python benchmarks/import_time.py --repeat 7
+"""
+
+import statistics
+import subprocess
+import sys
+
+import click
+
+
+"""Target cumulative import time of each entry point in milliseconds."""
+TARGETS = {
+    'ece312_clicker': 2,
+    'ece312_clicker.echo_server': 40,
+    'ece312_clicker.toggle_server': 40,
+    'ece312_clicker.gui': 50,
+}
+
+
+def measure_import_time(module):
+    """Return the cumulative import time of the module in milliseconds."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    # Lines look like "import time:   self [us] | cumulative | name"
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000
+
+    raise RuntimeError('Import time of {} not reported'.format(module))
+
+
+@click.command(help='Measure the import time of the ece312_clicker entry points.')
+@click.option('--repeat', default=5, help='Number of measurements of each entry point.')
+def main(repeat):
+    failed = False
+
+    for module, target in TARGETS.items():
+        # The first import compiles the bytecode, do not count it
+        measure_import_time(module)
+
+        median = statistics.median(
+            measure_import_time(module) for _ in range(repeat))
+        status = 'OK' if median <= target else 'SLOW'
+        failed = failed or median > target
+
+        print('{:32} {:8.1f} ms (target {:4} ms) {}'.format(
+            module, median, target, status))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Traffic capture.
+
+Records the connects, received lines and disconnects of all connections to a
+compact binary file that can be replayed later (see replay.py).
+
+The file starts with a header followed by the records:
+
+    header: magic (4 bytes), version (uint8)
+    record: time (double, seconds since the start of the capture),
+            event (uint8), connection (uint32), payload length (uint16),
+            payload (UTF-8)
+
+The payload of a connect record is the IP address of the client, of a data
+record the received line. Disconnect records have no payload. Connections are
+numbered in the order they were made. All integers are little endian.
+"""
+
+import itertools
+import struct
+import threading
+import time
+
+MAGIC = b'ECCP'
+VERSION = 1
+
+EVENT_CONNECT = 0
+EVENT_DATA = 1
+EVENT_DISCONNECT = 2
+
+_HEADER = struct.Struct('<4sB')
+_RECORD = struct.Struct('<dBIH')
+
+
+class CaptureError(Exception):
+    pass
+
+
+class CaptureWriter:
+    """Writes the captured traffic. Safe to use from the connection threads."""
+
+    def __init__(self, filename):
+        self.file = open(filename, 'wb')
+        self.file.write(_HEADER.pack(MAGIC, VERSION))
+
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.connection_ids = {}
+        self.connection_counter = itertools.count()
+
+    def _record(self, event, connection_id, payload=''):
+        payload = payload.encode('utf-8')[:0xFFFF]
+        record = _RECORD.pack(time.monotonic() - self.start, event,
+                              connection_id, len(payload)) + payload
+        # The file is buffered, the record is written to the disk in batches
+        self.file.write(record)
+
+    def connect(self, address):
+        with self.lock:
+            connection_id = next(self.connection_counter)
+            self.connection_ids[address] = connection_id
+            self._record(EVENT_CONNECT, connection_id, address[0])
+
+    def data(self, address, line):
+        with self.lock:
+            connection_id = self.connection_ids.get(address)
+            if connection_id is not None:
+                self._record(EVENT_DATA, connection_id, line)
+
+    def disconnect(self, address):
+        with self.lock:
+            connection_id = self.connection_ids.pop(address, None)
+            if connection_id is not None:
+                self._record(EVENT_DISCONNECT, connection_id)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_capture(filename):
+    """Yield the (time, event, connection, payload) records of the capture."""
+    with open(filename, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise CaptureError('Not a capture file')
+        magic, version = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise CaptureError('Not a capture file')
+        if version != VERSION:
+            raise CaptureError('Unsupported capture version {}'.format(version))
+
+        while True:
+            record = f.read(_RECORD.size)
+            if not record:
+                return
+            if len(record) != _RECORD.size:
+                raise CaptureError('Truncated capture')
+
+            timestamp, event, connection_id, length = _RECORD.unpack(record)
+            payload = f.read(length)
+            if len(payload) != length:
+                raise CaptureError('Truncated capture')
+
+            yield timestamp, event, connection_id, payload.decode('utf-8', 'replace')
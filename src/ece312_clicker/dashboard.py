@@ -0,0 +1,186 @@
+"""Live results for read-only dashboard subscribers.
+
+The dashboard server listens on a separate TCP port. Every subscriber gets the
+full state of the poll after connecting and then the changes of the tallies,
+one JSON object per line:
+
+    {"type": "poll", "question": "...", "answers": [...], "votes": [...]}
+    {"type": "delta", "votes": {"A": 2, "C": 1}}
+    {"type": "inactive"}
+
+The results are read from the poll at a fixed frame rate rather than on every
+vote, so the vote ingestion does not depend on the number of subscribers. A
+frame is encoded once and the same bytes are sent to all subscribers.
+"""
+
+import json
+import logging
+import selectors
+import socket
+import threading
+import time
+
+
+class DashboardServer:
+    """TCP server pushing the live poll results to the subscribers.
+
+    poll_source is a callable returning the active poll or None. It is called
+    from the dashboard thread once per frame.
+    """
+
+    def __init__(self, host, port, poll_source, frame_rate=4):
+        self.logger = logging.getLogger('Dashboard server')
+
+        self.poll_source = poll_source
+        self.frame_interval = 1 / frame_rate
+
+        # The last published state
+        self.poll = None
+        self.votes = None
+        self.full_frame = None
+
+        self.subscribers = set()
+        self.should_stop = False
+
+        self.listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listening_socket.bind((host, port))
+        self.listening_socket.listen(128)
+        self.listening_socket.setblocking(False)
+        self.server_address = self.listening_socket.getsockname()
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listening_socket, selectors.EVENT_READ)
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.logger.info('Dashboard on TCP/IP: %s', self.server_address)
+
+    def run(self):
+        next_frame = time.monotonic()
+
+        while not self.should_stop:
+            timeout = max(0, next_frame - time.monotonic())
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is self.listening_socket:
+                    self._accept()
+                else:
+                    self._read(key.fileobj)
+
+            if time.monotonic() >= next_frame:
+                self.publish()
+                next_frame = time.monotonic() + self.frame_interval
+
+    def publish(self):
+        """Send the changes since the last frame to all subscribers."""
+        frame = self._next_frame()
+        if frame is None:
+            return
+
+        for subscriber in list(self.subscribers):
+            self._send(subscriber, frame)
+
+    def _next_frame(self):
+        poll = self.poll_source()
+
+        if poll is None:
+            if self.poll is None and self.full_frame is not None:
+                return None
+            self.poll = None
+            self.votes = None
+            self.full_frame = None
+            return self._full_frame()
+
+        votes = dict(poll.votes)
+
+        if poll is not self.poll:
+            self.poll = poll
+            self.votes = votes
+            self.full_frame = None
+            return self._full_frame()
+
+        delta = {choice: count - self.votes[choice]
+                 for choice, count in votes.items()
+                 if count != self.votes[choice]}
+        if not delta:
+            return None
+
+        self.votes = votes
+        self.full_frame = None
+        return self._encode({'type': 'delta', 'votes': delta})
+
+    def _full_frame(self):
+        """Return the encoded last published state."""
+        if self.full_frame is None:
+            if self.poll is None:
+                state = {'type': 'inactive'}
+            else:
+                state = {'type': 'poll',
+                         'question': self.poll.question,
+                         'answers': self.poll.answers,
+                         'votes': [self.votes[choice]
+                                   for choice in self.poll.choices]}
+            self.full_frame = self._encode(state)
+        return self.full_frame
+
+    @staticmethod
+    def _encode(message):
+        return (json.dumps(message) + '\n').encode()
+
+    def _accept(self):
+        try:
+            subscriber, address = self.listening_socket.accept()
+        except BlockingIOError:
+            return
+
+        self.logger.info('Subscriber %s connected', address[0])
+        subscriber.setblocking(False)
+        self.selector.register(subscriber, selectors.EVENT_READ)
+        self.subscribers.add(subscriber)
+        self._send(subscriber, self._full_frame())
+
+    def _read(self, subscriber):
+        # The subscribers are read-only, anything they send is ignored
+        try:
+            data = subscriber.recv(1024)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self._drop(subscriber)
+
+    def _send(self, subscriber, frame):
+        # A subscriber that cannot take the whole frame right away is too slow
+        # and is dropped. It can reconnect and get the full state again.
+        try:
+            if subscriber.send(frame) == len(frame):
+                return
+        except OSError:
+            pass
+
+        self._drop(subscriber)
+
+    def _drop(self, subscriber):
+        self.logger.info('Subscriber disconnected')
+        self.selector.unregister(subscriber)
+        self.subscribers.discard(subscriber)
+        subscriber.close()
+
+    def subscriber_count(self):
+        """Return the number of connected subscribers."""
+        return len(self.subscribers)
+
+    def stop(self):
+        """Stop the dashboard thread and close all connections."""
+        self.should_stop = True
+        self.thread.join()
+
+        for subscriber in list(self.subscribers):
+            self._drop(subscriber)
+
+        self.selector.close()
+        self.listening_socket.close()
@@ -4,11 +4,7 @@ import logging
 import click
 import signal
 
-from .server import ClickerServer
-from .server_messaging import ServerMessaging
 from .poll import Poll, PollError
-from .questions import poll_questions
-from .protocol import PollProtocol
 
 
 class PollWindow(ttk.Frame):
@@ -60,24 +56,22 @@ class PollWindow(ttk.Frame):
                                         text='N/A',
                                         style='question.TLabel')
 
-        self.question_label.grid(column=0, row=0, columnspan=3, pady=(10, 30))
+        answer_count = len(self.poll.answers)
+        self.question_label.grid(column=0, row=0, columnspan=answer_count, pady=(10, 30))
 
-        answer_a = ttk.Label(self, text='N/A', style='answer.TLabel')
-        answer_b = ttk.Label(self, text='N/A', style='answer.TLabel')
-        answer_c = ttk.Label(self, text='N/A', style='answer.TLabel')
+        def create_answer(column):
+            answer = ttk.Label(self, text='N/A', style='answer.TLabel')
+            answer.grid(column=column, row=1, padx=25)
+            return answer
 
-        answer_a.grid(column=0, row=1)
-        answer_b.grid(column=1, row=1, padx=50)
-        answer_c.grid(column=2, row=1)
-
-        self.answer_labels = [answer_a, answer_b, answer_c]
+        self.answer_labels = [create_answer(x) for x in range(answer_count)]
 
         def create_counter(column):
             counter = ttk.Label(self, text='N/A', style='counter.TLabel')
             counter.grid(column=column, row=3)
             return counter
 
-        self.counter_labels = [create_counter(x) for x in range(3)]
+        self.counter_labels = [create_counter(x) for x in range(answer_count)]
 
         self.log_text = tk.Text(self)
 
@@ -85,7 +79,7 @@ class PollWindow(ttk.Frame):
     
     def update_poll(self):
         self.question_label['text'] = self.poll.question
-        for n in range(3):
+        for n in range(len(self.poll.answers)):
             self.answer_labels[n]['text'] = self.poll.answers[n]
             self.counter_labels[n]['text'] = '{}'.format(
                 self.poll.get_votes(n))
@@ -98,11 +92,16 @@ class PollWindow(ttk.Frame):
 
 
 class PollSelectionWindow(ttk.Frame):
-    def __init__(self, poll_protocol, master=None):
+
+    """The number of questions offered in the combo box."""
+    SEARCH_RESULTS = 30
+
+    def __init__(self, poll_protocol, question_bank, master=None):
         """"""
         super().__init__(master, padding=(10, 10, 12, 12))
 
         self.poll_protocol = poll_protocol
+        self.question_bank = question_bank
         self.logger = logging.getLogger('PollSelectionWindow')
 
         self.grid(column=0, row=0, sticky=(tk.N, tk.S, tk.E, tk.W))
@@ -124,11 +123,14 @@ class PollSelectionWindow(ttk.Frame):
         label = ttk.Label(self, text='Question: ')
         label.grid(row=1, column=1, pady=(0, first_row_padding), sticky='E')
 
-        self.question_combo_box = ttk.Combobox(self,
-                                               values=list(poll_questions.keys()),
-                                               state='readonly',
-                                               width=30)
-        self.question_combo_box.current(0)
+        # Only the questions matching the typed text are loaded from the bank
+        self.question_combo_box = ttk.Combobox(
+            self,
+            values=self.question_bank.search('', self.SEARCH_RESULTS),
+            width=30)
+        if self.question_combo_box['values']:
+            self.question_combo_box.current(0)
+        self.question_combo_box.bind('<KeyRelease>', self.question_typed)
         self.question_combo_box.grid(row=1, column=2, columnspan=2, pady=(0, first_row_padding))
 
         self.ip_checking_checkbox = ttk.Checkbutton(self, text='IP Checking Enable', variable=self.check_ip_variable,
@@ -146,13 +148,24 @@ class PollSelectionWindow(ttk.Frame):
 
         self.set_state('inactive')
 
+    def question_typed(self, event):
+        self.question_combo_box['values'] = self.question_bank.search(
+            self.question_combo_box.get(), self.SEARCH_RESULTS)
+
     def open_poll_clicked(self):
         question = self.question_combo_box.get()
-        answers = poll_questions[question]
+        try:
+            answers = self.question_bank.answers(question)
+        except KeyError:
+            self.logger.warning('Question "%s" is not in the question bank', question)
+            return
 
         self.logger.info('Poll selected. Question: "%s", Answers: %s', question, answers)
 
-        poll = Poll(question, answers)
+        self.open_poll(Poll(question, answers))
+
+    def open_poll(self, poll):
+        """Activate the poll and open the window with the results."""
         self.poll_protocol.activate(poll)
 
         self.set_state('active')
@@ -187,32 +200,59 @@ class PollSelectionWindow(ttk.Frame):
 @click.option('--host', default='0.0.0.0', help='The address the TCP server listens on.')
 @click.option('--port', default=2000, help='The port the TCP server listens on.')
 @click.option('--verbose', is_flag=True, default=False, help='Enables additional debug prints.')
-def main(host, port, verbose):
+@click.option('--snapshot', default=None, type=click.Path(dir_okay=False),
+              help='File used to save the server state and restore it after a restart.')
+@click.option('--snapshot-period', default=5.0, help='Period of saving the snapshot in seconds.')
+@click.option('--accept-rate', default=None, type=float,
+              help='Maximal number of accepted connections per second.')
+@click.option('--bank', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='Question bank database. The built-in questions are used if not given.')
+@click.option('--dashboard-port', default=None, type=int,
+              help='The port for the read-only live results. Disabled if not given.')
+@click.option('--dashboard-rate', default=4.0, help='Live results updates per second.')
+@click.option('--capture', default=None, type=click.Path(dir_okay=False),
+              help='Record the incoming traffic to the file for a later replay.')
+@click.option('--trace', default=None, type=click.Path(dir_okay=False),
+              help='Trace the latency of the messages and save a Chrome trace to the file.')
+@click.option('--trace-sample', default=100, help='Trace every n-th message.')
+@click.option('--queue-size', default=10000,
+              help='Maximal number of messages waiting for the GUI or the server, 0 is unlimited.')
+def main(host, port, verbose, snapshot, snapshot_period, accept_rate, bank,
+         dashboard_port, dashboard_rate, capture, trace, trace_sample, queue_size):
+
+    # The server side is imported here so that importing this module (and
+    # printing --help) does not pay for it
+    from .server import ClickerServer
+    from .server_messaging import ServerMessaging
+    from .protocol import create_poll_protocol
+    from .snapshot import save_snapshot, load_snapshot, state_key, SnapshotError
+    from .question_bank import QuestionBank
+    from .dashboard import DashboardServer
+    from .capture import CaptureWriter
+    from . import tracing
 
     if verbose:
         logging.basicConfig(level=logging.DEBUG)
     else:
         logging.basicConfig(level=logging.INFO)
 
-    server_messaging = ServerMessaging()
-    server = ClickerServer(host, port, server_messaging)
-    
-    server_messaging.server_register_callback('broadcast_message', server.broadcast)
-
-    poll_protocol = PollProtocol(
-        lambda ip, message: server_messaging.gui_post('send_message', (ip, message)),
-        lambda message: server_messaging.gui_post('broadcast_message', message)
-    )
+    if trace:
+        tracing.enable(trace_sample)
 
-    server_messaging.gui_register_callbacks(
-        'received', lambda message: poll_protocol.on_data(message[0], message[1]))
+    server_messaging = ServerMessaging(gui_queue_size=queue_size,
+                                       server_queue_size=queue_size)
+    capture_writer = CaptureWriter(capture) if capture else None
+    server = ClickerServer(host, port, server_messaging, accept_rate=accept_rate,
+                           capture=capture_writer)
 
-    server_messaging.gui_register_callbacks(
-        'connected', poll_protocol.on_new_connection)
+    server_messaging.server_register_callback('broadcast_message', server.broadcast)
 
-    server_messaging.gui_register_callbacks(
-        'disconnected', lambda message: None)
+    poll_protocol = create_poll_protocol(server_messaging)
 
+    dashboard = None
+    if dashboard_port is not None:
+        dashboard = DashboardServer(host, dashboard_port,
+                                    lambda: poll_protocol.poll, dashboard_rate)
 
     root = tk.Tk()
 
@@ -222,11 +262,62 @@ def main(host, port, verbose):
 
     root.after(100, periodic_messaging_check)
 
-    app = PollSelectionWindow(poll_protocol, master=root)
+    if bank:
+        question_bank = QuestionBank(bank)
+    else:
+        from .questions import poll_questions
+        question_bank = QuestionBank.from_dict(poll_questions)
+
+    app = PollSelectionWindow(poll_protocol, question_bank, master=root)
+
+    if snapshot:
+        try:
+            restored_poll = load_snapshot(snapshot)
+        except SnapshotError as e:
+            logging.getLogger('Snapshot').error(
+                'Cannot restore the snapshot %s: %s', snapshot, e)
+            restored_poll = None
+
+        if restored_poll:
+            logging.getLogger('Snapshot').info(
+                'Restored the poll "%s"', restored_poll.question)
+            app.open_poll(restored_poll)
+
+        # The encoding blocks the GUI thread, an unchanged poll is not saved
+        saved_state = [state_key(restored_poll)]
+
+        def periodic_snapshot():
+            state = state_key(poll_protocol.poll)
+            if state != saved_state[0]:
+                save_snapshot(snapshot, poll_protocol.poll)
+                saved_state[0] = state
+            root.after(int(snapshot_period * 1000), periodic_snapshot)
+
+        root.after(int(snapshot_period * 1000), periodic_snapshot)
+
     app.mainloop()
 
+    if snapshot:
+        save_snapshot(snapshot, poll_protocol.poll)
+
+    if dashboard:
+        dashboard.stop()
+
     server.stop()
 
+    if server_messaging.shed_counts:
+        logging.getLogger('Server messaging').info(
+            'Dropped repeated or cancelled messages: %s', dict(server_messaging.shed_counts))
+
+    if capture_writer:
+        capture_writer.close()
+
+    if trace:
+        tracer = tracing.get_tracer()
+        tracer.export_chrome_trace(trace)
+        logging.getLogger('Tracing').info(
+            'Latency from the previous stage:\n%s', tracer.histogram_table())
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,55 @@
+"""In-memory transport for the clicker server.
+
+LoopbackConnection stands in for ClickerConnection without sockets or
+threads. Together with ClickerServer(..., listen=False) and a synchronous
+ServerMessaging the whole message path runs in the calling thread with
+deterministic ordering, which makes it suitable for tests and benchmarks.
+"""
+
+import itertools
+
+from . import tracing
+
+
+class LoopbackConnection:
+    """A client connection that lives in memory.
+
+    The messages the server sends to the client are collected in the list
+    `received`.
+    """
+
+    # Unique ports so that connections from one IP address can be told apart
+    _ports = itertools.count(1)
+
+    def __init__(self, clicker_server, ip, port=None):
+        if port is None:
+            port = next(LoopbackConnection._ports)
+
+        self.clicker_server = clicker_server
+        self.client_address = (ip, port)
+        self.received = []
+
+    def connect(self):
+        """Register the connection with the server, as on a TCP connect."""
+        self.clicker_server.register_connection(self)
+        return self
+
+    def disconnect(self):
+        """Deregister the connection, as when the client closes it."""
+        self.clicker_server.deregister_connection(self)
+
+    def send_line(self, line):
+        """Pass a line from the client to the server."""
+        tracing.begin()
+        self.clicker_server.handle_message(self.client_address, line.strip())
+        tracing.activate(None)
+
+    def send_message(self, message):
+        """Receive a message from the server. Called by the server."""
+        self.received.append(message)
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *args):
+        self.disconnect()
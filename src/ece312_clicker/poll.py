@@ -1,3 +1,6 @@
+import collections
+import string
+
 
 class PollError(Exception):
     pass
@@ -5,43 +8,114 @@ class PollError(Exception):
 class PollAlreadyVoted(PollError):
     pass
 
+# Results of the votes in Poll.vote_many()
+VOTE_ACCEPTED = 'accepted'
+VOTE_DUPLICATE = 'duplicate'
+VOTE_INVALID = 'invalid'
+
 class Poll:
+    # The choices are letters, 'A' for the first answer and so on
+    CHOICES = string.ascii_uppercase
+
     def __init__(self, question, answers):
+        """Create the poll.
+
+        The voters are identified by (device ID, IP) pairs, the device ID is
+        None for clients that did not send it. The voters are kept in a set,
+        so a duplicate check is a single hash lookup and the memory grows with
+        the number of voters.
+        """
         self.question = question
 
-        if len(answers) != 3:
-            raise ValueError('Only 3 answers in a poll are supported.')
-        
+        if not 2 <= len(answers) <= len(Poll.CHOICES):
+            raise ValueError('A poll needs 2 to {} answers.'.format(
+                len(Poll.CHOICES)))
+
         self.answers = answers
+        self.choices = list(Poll.CHOICES[:len(answers)])
 
-        self.registered_ip_addresses = []
+        self.registered_voters = set()
 
-        self.votes = {'A': 0, 'B': 0, 'C': 0}
+        self.votes = {choice: 0 for choice in self.choices}
 
     def register_vote_updated_callback(self, cb):
         self.vote_updated_cb = cb
 
-    def vote(self, ip, choice):
-        if ip in self.registered_ip_addresses:
-            raise PollAlreadyVoted('IP {} already voted.'.format(ip))
-        
-        if not Poll.check_choice_is_valid(choice):
+    def vote(self, ip, choice, device_id=None):
+        voter = (device_id, ip)
+        if voter in self.registered_voters:
+            raise PollAlreadyVoted('{} already voted.'.format(
+                Poll._voter_name(ip, device_id)))
+
+        if not self.is_valid_choice(choice):
             raise PollError('Invalid choice "{}"'.format(choice))
-        
+
         self.votes[choice] += 1
 
-        self.registered_ip_addresses.append(ip)
+        self.registered_voters.add(voter)
 
         self.vote_updated_cb()
 
+    def vote_many(self, ips, choices, device_ids=None):
+        """Vote for a batch of voters at once.
+
+        Return the result of every vote: VOTE_ACCEPTED, VOTE_DUPLICATE (also
+        for the second vote of a voter within the batch) or VOTE_INVALID. The
+        tallies are updated once per choice and the callback is called once.
+        """
+        if device_ids is None:
+            device_ids = [None] * len(ips)
+
+        results = []
+        counts = collections.Counter()
+        accepted = set()
+
+        for ip, choice, device_id in zip(ips, choices, device_ids):
+            if choice not in self.votes:
+                results.append(VOTE_INVALID)
+                continue
+
+            voter = (device_id, ip)
+            if voter in accepted or voter in self.registered_voters:
+                results.append(VOTE_DUPLICATE)
+            else:
+                accepted.add(voter)
+                counts[choice] += 1
+                results.append(VOTE_ACCEPTED)
+
+        for choice, count in counts.items():
+            self.votes[choice] += count
+
+        self.registered_voters.update(accepted)
+
+        if accepted:
+            self.vote_updated_cb()
+
+        return results
+
+    def register_voter(self, ip, device_id=None):
+        """Mark the voter as voted without counting a vote."""
+        self.registered_voters.add((device_id, ip))
+
     def get_votes(self, choice):
         if isinstance(choice, int):
-            choice = ['A', 'B', 'C'][choice]
+            choice = self.choices[choice]
         return self.votes[choice]
         
-    def ip_voted(self, ip):
-        return ip in self.registered_ip_addresses
+    def ip_voted(self, ip, device_id=None):
+        return (device_id, ip) in self.registered_voters
+
+    @staticmethod
+    def _voter_name(ip, device_id):
+        if device_id is None:
+            return 'IP {}'.format(ip)
+        return 'Device {} at IP {}'.format(device_id, ip)
+
+    def is_valid_choice(self, choice):
+        """Check the choice is one of the answers of this poll."""
+        return choice in self.votes
 
     @staticmethod
     def check_choice_is_valid(choice):
-        return choice in ['A', 'B', 'C']
\ No newline at end of file
+        """Check the choice could be valid in a poll with any number of answers."""
+        return len(choice) == 1 and choice in Poll.CHOICES
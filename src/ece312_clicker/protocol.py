@@ -1,10 +1,28 @@
 
-from .poll import Poll, PollAlreadyVoted
+from . import tracing
+from .poll import Poll, PollAlreadyVoted, VOTE_ACCEPTED, VOTE_DUPLICATE
 
 class PollProtocol:
+    """The voting protocol.
+
+    The clients are identified by their address, an (ip, port) pair. A client
+    may introduce itself with a line "ID <device ID>" so that several devices
+    behind one IP address (NAT) can vote. Clients without the device ID are
+    identified by the IP address only.
+
+    A connection sets its device ID once, before its first vote. Otherwise
+    a single connection could vote again under every new ID.
+    """
+
+    DEVICE_ID_PREFIX = 'ID '
+    MAX_DEVICE_ID_LENGTH = 64
+
     def __init__(self, send_message_callback, broadcast_callback):
         self.send_message_callback = send_message_callback
         self.broadcast_callback = broadcast_callback
+        # The device ID of every connection that has set it or voted, None
+        # if it voted without one. Listed connections cannot set the ID.
+        self.device_ids = {}
         self.deactivate()
 
     def activate(self, poll):
@@ -17,27 +35,141 @@ class PollProtocol:
         self.broadcast_callback('inactive')
         self.poll = None
 
-    def on_new_connection(self, ip):
-        if self.poll:
-            if self.poll.ip_voted(ip):
-                self.send_message_callback(ip, 'voted')
-            else:
-                self.send_message_callback(ip, 'active')
-        else:
-            self.send_message_callback(ip, 'inactive')
+    def status(self, address):
+        """Return the state of the poll for the client."""
+        if not self.poll:
+            return 'inactive'
+        if self.poll.ip_voted(address[0], self.device_ids.get(address)):
+            return 'voted'
+        return 'active'
+
+    def on_new_connection(self, address):
+        self.send_message_callback(address, self.status(address))
 
-    def on_data(self, ip, data):
+    def on_disconnect(self, address):
+        self.device_ids.pop(address, None)
+
+    def on_data(self, address, data):
+        tracing.stamp('on_data')
         data = data.strip()
 
-        if not Poll.check_choice_is_valid(data):
-            self.send_message_callback(ip, 'error')
+        if data.startswith(PollProtocol.DEVICE_ID_PREFIX):
+            self.on_device_id(address, data[len(PollProtocol.DEVICE_ID_PREFIX):])
+            return
+
+        if self.poll:
+            valid = self.poll.is_valid_choice(data)
+        else:
+            valid = Poll.check_choice_is_valid(data)
+
+        if not valid:
+            self.send_message_callback(address, 'error')
             return
 
         if self.poll:
             try:
-                self.poll.vote(ip, data)
-                self.send_message_callback(ip, 'OK')
+                device_id = self.device_ids.setdefault(address, None)
+                self.poll.vote(address[0], data, device_id)
+                tracing.stamp('vote')
+                self.send_message_callback(address, 'OK')
             except PollAlreadyVoted:
-                self.send_message_callback(ip, 'voted')
+                self.send_message_callback(address, 'voted')
         else:
-            self.send_message_callback(ip, 'inactive')
+            self.send_message_callback(address, 'inactive')
+
+    def on_device_id(self, address, device_id):
+        """Handle the device ID handshake. Reply with the state of the poll."""
+        self.send_message_callback(address, self._device_id_reply(address, device_id))
+
+    def _device_id_reply(self, address, device_id):
+        device_id = device_id.strip()
+
+        if (address in self.device_ids or not device_id or len(device_id) > PollProtocol.MAX_DEVICE_ID_LENGTH
+                or len(device_id.split()) != 1):
+            return 'error'
+
+        self.device_ids[address] = device_id
+        return self.status(address)
+
+    def on_data_batch(self, messages):
+        """Handle a batch of (address, data) messages.
+
+        The votes are passed to the poll in batches. Return the list of
+        (address, reply) pairs in the order of the messages, the caller sends
+        them to the clients.
+        """
+        tracing.stamp('on_data')
+        replies = []
+        votes = []
+
+        for address, data in messages:
+            data = data.strip()
+
+            if data.startswith(PollProtocol.DEVICE_ID_PREFIX):
+                # The device ID applies to the following votes only
+                self._vote_batch(votes, replies)
+                replies.append((address, self._device_id_reply(
+                    address, data[len(PollProtocol.DEVICE_ID_PREFIX):])))
+            elif self.poll:
+                # Only a valid vote closes the device ID, as in on_data()
+                if self.poll.is_valid_choice(data):
+                    self.device_ids.setdefault(address, None)
+                # Placeholder, replaced by the result of the vote
+                votes.append((len(replies), address, data))
+                replies.append(None)
+            elif Poll.check_choice_is_valid(data):
+                replies.append((address, 'inactive'))
+            else:
+                replies.append((address, 'error'))
+
+        self._vote_batch(votes, replies)
+        tracing.stamp('vote')
+
+        return replies
+
+    def _vote_batch(self, votes, replies):
+        if not votes:
+            return
+
+        _, addresses, choices = zip(*votes)
+        results = self.poll.vote_many(
+            [address[0] for address in addresses], choices,
+            [self.device_ids.get(address) for address in addresses])
+
+        for (index, address, _), result in zip(votes, results):
+            if result == VOTE_ACCEPTED:
+                replies[index] = (address, 'OK')
+            elif result == VOTE_DUPLICATE:
+                replies[index] = (address, 'voted')
+            else:
+                replies[index] = (address, 'error')
+
+        del votes[:]
+
+
+def create_poll_protocol(server_messaging):
+    """Create the protocol connected to the GUI side of the messaging.
+
+    The received messages are handled in batches. The server has to register
+    the 'send_message', 'send_messages' and 'broadcast_message' callbacks on
+    its side.
+    """
+    poll_protocol = PollProtocol(
+        lambda address, message: server_messaging.gui_post('send_message', (address, message)),
+        lambda message: server_messaging.gui_post('broadcast_message', message)
+    )
+
+    def on_received(messages):
+        replies = poll_protocol.on_data_batch(messages)
+        if replies:
+            server_messaging.gui_post('send_messages', replies)
+
+    server_messaging.gui_register_batch_callbacks('received', on_received)
+
+    server_messaging.gui_register_callbacks(
+        'connected', poll_protocol.on_new_connection)
+
+    server_messaging.gui_register_callbacks(
+        'disconnected', poll_protocol.on_disconnect)
+
+    return poll_protocol
@@ -0,0 +1,161 @@
+"""Question bank.
+
+The questions are stored in an SQLite database so that the bank can hold tens
+of thousands of questions without loading them at startup. The questions are
+searched by prefix (indexed) and by words (FTS5 full-text index, if the SQLite
+library supports it). Recently used questions are kept in an LRU cache.
+
+To import questions from a JSON file ({"question": ["answer", ...], ...}):
+
+    python -m ece312_clicker.question_bank bank.sqlite questions.json
+"""
+
+import functools
+import json
+import logging
+import sqlite3
+
+import click
+
+
+class QuestionBank:
+    """Questions with their answers stored in an SQLite database."""
+
+    def __init__(self, filename=':memory:', cache_size=128):
+        self.logger = logging.getLogger('Question bank')
+
+        self.db = sqlite3.connect(filename)
+        # Let SQLite read the database through a memory map
+        self.db.execute('PRAGMA mmap_size = 268435456')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS questions ('
+            'id INTEGER PRIMARY KEY, '
+            "course TEXT NOT NULL DEFAULT '', "
+            'question TEXT NOT NULL UNIQUE COLLATE NOCASE, '
+            'answers TEXT NOT NULL)')
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS questions_course ON questions (course)')
+
+        try:
+            self.db.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts '
+                'USING fts5(question)')
+            self.full_text = True
+        except sqlite3.OperationalError:
+            self.logger.info('FTS5 is not available, only prefix search works')
+            self.full_text = False
+
+        self.db.commit()
+
+        self._cached_answers = functools.lru_cache(maxsize=cache_size)(
+            self._load_answers)
+
+    @classmethod
+    def from_dict(cls, questions, filename=':memory:', course=''):
+        """Create a bank from a dict {question: answers}."""
+        bank = cls(filename)
+        bank.add_many(questions.items(), course)
+        return bank
+
+    def add(self, question, answers, course=''):
+        """Add a question or replace the answers of an existing one."""
+        self.add_many([(question, answers)], course)
+
+    def add_many(self, questions, course=''):
+        """Add (question, answers) pairs in a single transaction."""
+        with self.db:
+            for question, answers in questions:
+                row = self.db.execute(
+                    'SELECT id FROM questions WHERE question = ?',
+                    (question,)).fetchone()
+
+                if row:
+                    self.db.execute(
+                        'UPDATE questions SET answers = ?, course = ? '
+                        'WHERE id = ?', (json.dumps(answers), course, row[0]))
+                    continue
+
+                cursor = self.db.execute(
+                    'INSERT INTO questions (course, question, answers) '
+                    'VALUES (?, ?, ?)', (course, question, json.dumps(answers)))
+
+                if self.full_text:
+                    self.db.execute(
+                        'INSERT INTO questions_fts (rowid, question) '
+                        'VALUES (?, ?)', (cursor.lastrowid, question))
+
+        self._cached_answers.cache_clear()
+
+    def search(self, text, limit=20, course=None):
+        """Return up to limit questions matching the text.
+
+        Questions starting with the text come first, followed by the questions
+        containing words starting with the words of the text.
+        """
+        text = text.strip()
+        course_filter = '' if course is None else ' AND course = ?'
+        course_args = () if course is None else (course,)
+
+        escaped = (text.replace('\\', '\\\\')
+                   .replace('%', '\\%').replace('_', '\\_'))
+        results = [row[0] for row in self.db.execute(
+            "SELECT question FROM questions WHERE question LIKE ? ESCAPE '\\'"
+            + course_filter + ' ORDER BY question LIMIT ?',
+            (escaped + '%',) + course_args + (limit,))]
+
+        words = text.split()
+        if self.full_text and words and len(results) < limit:
+            query = ' '.join('"{}"*'.format(word.replace('"', '""'))
+                             for word in words)
+            rows = self.db.execute(
+                'SELECT questions.question FROM questions_fts '
+                'JOIN questions ON questions.id = questions_fts.rowid '
+                'WHERE questions_fts MATCH ?' + course_filter +
+                ' ORDER BY questions_fts.rank LIMIT ?',
+                (query,) + course_args + (limit,))
+
+            found = set(results)
+            for question, in rows:
+                if question not in found and len(results) < limit:
+                    results.append(question)
+
+        return results
+
+    def answers(self, question):
+        """Return the answers of the question. Raise KeyError if missing."""
+        return self._cached_answers(question)
+
+    def _load_answers(self, question):
+        row = self.db.execute(
+            'SELECT answers FROM questions WHERE question = ?',
+            (question,)).fetchone()
+        if row is None:
+            raise KeyError(question)
+        return json.loads(row[0])
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM questions').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+@click.command(help='Import questions from a JSON file to the question bank.')
+@click.argument('bank', type=click.Path(dir_okay=False))
+@click.argument('json_file', type=click.File('r'))
+@click.option('--course', default='', help='The course of the imported questions.')
+def import_questions(bank, json_file, course):
+    logging.basicConfig(level=logging.INFO)
+
+    questions = json.load(json_file)
+    question_bank = QuestionBank(bank)
+    question_bank.add_many(questions.items(), course)
+
+    logging.getLogger('Question bank').info(
+        'Imported %i questions, the bank has %i questions',
+        len(questions), len(question_bank))
+    question_bank.close()
+
+
+if __name__ == '__main__':
+    import_questions()
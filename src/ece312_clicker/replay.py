@@ -0,0 +1,137 @@
+"""Replay of captured traffic.
+
+Drives the traffic recorded by the capture (see capture.py) against a clicker
+server, at the original speed, faster, or as fast as possible.
+
+By default the traffic is replayed in this process against a server with the
+in-memory transport (see loopback.py), so the replay is deterministic and can
+be profiled with --profile. With --port the traffic is sent to a running
+server over TCP instead; all connections then come from the local IP address.
+
+    python -m ece312_clicker.replay lecture.capture --speed 0 --profile replay.prof
+"""
+
+import cProfile
+import logging
+import pstats
+import socket
+import time
+
+import click
+
+from .capture import read_capture, EVENT_CONNECT, EVENT_DATA, EVENT_DISCONNECT
+
+
+class _Pacer:
+    """Waits until the time of the next record at the given speed."""
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.start = time.monotonic()
+
+    def wait(self, timestamp):
+        if not self.speed:
+            return
+        delay = self.start + timestamp / self.speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def replay_in_process(records, speed, answer_count=3):
+    """Replay the records against an in-memory server. Return the poll."""
+    # Not needed for the TCP replay
+    from .loopback import LoopbackConnection
+    from .poll import Poll
+    from .protocol import create_poll_protocol
+    from .server import ClickerServer
+    from .server_messaging import ServerMessaging
+
+    server_messaging = ServerMessaging(synchronous=True)
+    server = ClickerServer(None, None, server_messaging, listen=False)
+    server_messaging.server_register_callback('broadcast_message', server.broadcast)
+    poll_protocol = create_poll_protocol(server_messaging)
+
+    poll = Poll('Replay', ['Answer {}'.format(n + 1) for n in range(answer_count)])
+    poll.register_vote_updated_callback(lambda: None)
+    poll_protocol.activate(poll)
+
+    connections = {}
+    pacer = _Pacer(speed)
+
+    try:
+        for timestamp, event, connection_id, payload in records:
+            pacer.wait(timestamp)
+
+            if event == EVENT_CONNECT:
+                connection = LoopbackConnection(server, payload)
+                connections[connection_id] = connection.connect()
+            elif event == EVENT_DATA:
+                connections[connection_id].send_line(payload)
+            elif event == EVENT_DISCONNECT:
+                connections.pop(connection_id).disconnect()
+    finally:
+        server.stop()
+
+    return poll
+
+
+def replay_tcp(records, speed, host, port):
+    """Replay the records against a running server over TCP."""
+    connections = {}
+    pacer = _Pacer(speed)
+
+    try:
+        for timestamp, event, connection_id, payload in records:
+            pacer.wait(timestamp)
+
+            if event == EVENT_CONNECT:
+                connections[connection_id] = socket.create_connection((host, port))
+            elif event == EVENT_DATA:
+                connections[connection_id].sendall((payload + '\n').encode())
+            elif event == EVENT_DISCONNECT:
+                connections.pop(connection_id).close()
+    finally:
+        for connection in connections.values():
+            connection.close()
+
+
+@click.command(help='Replay captured traffic against the clicker server.')
+@click.argument('capture_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--speed', default=1.0, help='Replay speed, 1 is real time, 0 is as fast as possible.')
+@click.option('--host', default='localhost', help='The address of the server for --port.')
+@click.option('--port', default=None, type=int,
+              help='Replay to a running server over TCP instead of in this process.')
+@click.option('--answers', default=3, help='Number of answers of the replayed poll.')
+@click.option('--profile', default=None, type=click.Path(dir_okay=False),
+              help='Profile the replay with cProfile and save the statistics to the file.')
+def main(capture_file, speed, host, port, answers, profile):
+    logging.basicConfig(level=logging.WARNING)
+
+    # Read the whole capture first so that the replay does not wait for the disk
+    records = list(read_capture(capture_file))
+
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+
+    start = time.monotonic()
+    if port is None:
+        poll = replay_in_process(records, speed, answers)
+    else:
+        poll = None
+        replay_tcp(records, speed, host, port)
+    duration = time.monotonic() - start
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(profile)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+
+    click.echo('Replayed {} records in {:.3f} s'.format(len(records), duration))
+    if poll:
+        click.echo('Votes: {}'.format(', '.join(
+            '{}: {}'.format(choice, poll.get_votes(choice)) for choice in poll.choices)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,136 +1,322 @@
 """TCP server.
 
-Multithreaded TCP server for the clicker.
+TCP server for the clicker. All connections are served from a single thread
+with a selector loop.
 """
 
 import threading
-import socketserver
+import selectors
+import socket
 import time
 import logging
 
+from . import tracing
 
-class ClickerConnectionHandler(socketserver.StreamRequestHandler):
-    """Handler to the TCP connections.
 
-    Methods setup(), finish() and handle() are callbacks. The callbacks are
-    exepcted to be executed by a thread (one thread per connection).
-    """
+class ClickerConnection:
+    """A TCP connection of a client.
 
-    def setup(self):
-        """Call at the time of establishing the connection.
+    The server keeps thousands of mostly idle connections, so the record is
+    kept small: no thread, no file objects and no logger per connection. The
+    receive buffer exists only while a partial line waits for its end, the
+    outgoing buffer only while the client does not read fast enough.
+    """
 
-        This is a callback.
-        """
-        super().setup()
+    __slots__ = ('server', 'connection', 'client_address', 'buffer', 'outgoing')
 
-        self.logger = logging.getLogger(
-            'Connection {}'.format(self.client_address[0]))
-        self.logger.info('Connected')
-        self.server.clicker_server.register_connection(self)
+    """Longest line accepted from a client. Longer lines close the connection."""
+    MAX_LINE_LENGTH = 1024
 
-    def finish(self):
-        """Call when the connection is closing.
+    """Most bytes waiting to be sent to a client. More close the connection."""
+    MAX_OUTGOING = 65536
 
-        This is a callback.
-        """
-        self.server.clicker_server.deregister_connection(self)
+    def __init__(self, server, connection, client_address):
+        self.server = server
+        self.connection = connection
+        self.client_address = client_address
+        self.buffer = None
+        self.outgoing = None
 
-        self.logger.info('Disconnected')
-        super().finish()
+    def data_received(self, data):
+        """Split the received data to lines and pass them to the server.
 
-    def handle(self):
-        """Handle the new connection.
-
-        This is a callback. Waits for the incomming data and passes it to
-        the server.
+        Return False if the client sent a line that is too long.
         """
-        try:
-            while True:
-                # Wait for a line of data and strip all white characters
-                data = self.rfile.readline()
-                if not data:
-                    break
+        if self.buffer:
+            data = self.buffer + data
 
-                # Decode the incomming data
-                data = data.strip().decode('ASCII')
+        *lines, rest = data.split(b'\n')
+        if any(len(line) > ClickerConnection.MAX_LINE_LENGTH
+               for line in (rest, *lines)):
+            return False
+        self.buffer = rest or None
 
-                self.logger.debug('Data received: "%s"', data)
+        for line in lines:
+            tracing.begin()
 
-                # Pass it to the server for handling
-                self.server.clicker_server.handle_message(
-                    self.client_address[0], data)
+            # Decode the incomming data and strip all white characters
+            line = line.strip().decode('ASCII', 'replace')
+            self.server.logger.debug('Data received from %s: "%s"',
+                                     self.client_address, line)
 
-        except BrokenPipeError:
-            self.logger.info('Connection broken')
-        except ConnectionResetError:
-            self.logger.info('Connection reset error')
-        except OSError:
-            self.logger.info('OSError')
+            # Pass it to the server for handling
+            self.server.handle_message(self.client_address, line)
+            tracing.activate(None)
+
+        return True
 
     def send_message(self, message):
         """Send the message to the client.
 
-        A new-line character will be added to the end of the message.
+        A new-line character will be added to the end of the message. The
+        socket is non-blocking: what does not fit in the socket buffer is kept
+        in the outgoing buffer and sent by the server thread later.
+        """
+        self.server.logger.debug('Sending message to %s: "%s"',
+                                 self.client_address, message)
+        data = (message+'\n').encode()
+
+        with self.server.outgoing_lock:
+            if self.outgoing is not None:
+                # Keep the order, the server thread sends the buffer first.
+                # Past the limit the server thread closes the connection.
+                if len(self.outgoing) <= ClickerConnection.MAX_OUTGOING:
+                    self.outgoing += data
+                    if len(self.outgoing) > ClickerConnection.MAX_OUTGOING:
+                        self.server.outgoing_pending.add(self)
+                return
+
+            try:
+                sent = self.connection.send(data)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                # The server thread closes the connection when it reads the EOF
+                self.server.logger.info('Sending to %s failed', self.client_address)
+                return
+
+            if sent < len(data):
+                self.outgoing = bytearray(data[sent:])
+                self.server.outgoing_pending.add(self)
+
+    def flush(self):
+        """Send the outgoing buffer. Return True if it is empty now.
+
+        Called by the server thread when the socket is writable.
         """
-        self.logger.debug('Sending message: "%s"', message)
-        self.wfile.write((message+'\n').encode())
+        with self.server.outgoing_lock:
+            if self.outgoing is None:
+                return True
+
+            try:
+                sent = self.connection.send(self.outgoing)
+            except BlockingIOError:
+                return False
+            del self.outgoing[:sent]
+
+            if self.outgoing:
+                return False
+            self.outgoing = None
+            return True
 
 
 class ClickerServer:
     """TCP server for the Clicker application.
 
-    Uses the threaded TCP server from the standard library to listen for TCP
-    connections. Once a TCP connection is made a new thread is created to
-    handle the incoming data and the connection is also registered in a list
-    withing this object.
+    A single thread waits for new connections and for the incoming data of all
+    connections (selectors). The connections are registered in a dict within
+    this object.
 
     The incoming data is passed to this object method handle_message().
     Outgoing data is passed to the connections that have been registered
-    in the connections list.
-
-    The TCP server runs in a thread and also creates a separate thread for each
-    connection.
+    in the connections dict. The connections are identified by the client
+    address, an (ip, port) pair, so that several clients behind one IP address
+    can be told apart.
+
+    The outgoing data is sent from the thread reading the messages from the
+    GUI. The sockets are non-blocking, so a client that does not read its
+    replies cannot stop the other clients; the rest of the data is sent by the
+    server thread when the socket becomes writable.
     """
 
-    def __init__(self, host, port, server_messaging):
+    """Size of the queue of connections waiting to be accepted."""
+    LISTEN_BACKLOG = 1024
+
+    """Period of checking whether the server should stop in seconds."""
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, host, port, server_messaging, accept_rate=None,
+                 listen=True, capture=None):
         """Initialize the server.
 
         The server will be started on (host, port) as a background thread.
+        If accept_rate is given, at most accept_rate new connections per second
+        are accepted, the others wait in the listen backlog. This spreads out
+        the reconnecting clients after a restart. If listen is False, no TCP
+        server is started and the connections have to be registered directly
+        (see loopback.py). If capture (a CaptureWriter) is given, the incoming
+        traffic is recorded.
         """
         self.logger = logging.getLogger('Clicker server')
 
         self.host = host
         self.port = port
+        self.accept_interval = 1 / accept_rate if accept_rate else 0
+        self.capture = capture
 
-        self.connections = []
+        self.connections = {}
         self.connections_lock = threading.Lock()
 
+        # Connections with data in the outgoing buffer the server thread does
+        # not wait to send yet
+        self.outgoing_lock = threading.Lock()
+        self.outgoing_pending = set()
+
         self.should_stop = False
 
         self.server_messaging = server_messaging
         self.server_messaging.server_register_callback('send_message', self.send_message)
+        self.server_messaging.server_register_callback('send_messages', self.send_messages)
         self.server_checking_thread = threading.Thread(target=self.message_reader)
         self.server_checking_thread.start()
 
-        self._setup_server()
+        self.selector = None
+        self.server_address = None
+        if listen:
+            self._setup_server()
 
     def _setup_server(self):
         """Private method to start the TCP server."""
-        socketserver.ThreadingTCPServer.allow_reuse_address = True
-        self.server = socketserver.ThreadingTCPServer(
-            (self.host, self.port), ClickerConnectionHandler)
-
-        # Register itself with the TCP server. The TCP handlers have access to
-        # this reference and therefore can communicate with the ClickerServer
-        # object
-        self.server.clicker_server = self
-
-        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listening_socket.bind((self.host, self.port))
+        self.listening_socket.listen(ClickerServer.LISTEN_BACKLOG)
+        self.listening_socket.setblocking(False)
+        self.server_address = self.listening_socket.getsockname()
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listening_socket, selectors.EVENT_READ)
+        self.accept_paused_until = None
+
+        self.server_thread = threading.Thread(target=self._serve)
         self.server_thread.daemon = True
         self.server_thread.start()
 
         self.logger.info('Server thread running in the background.')
-        self.logger.info('TCP/IP: %s', self.server.server_address)
+        self.logger.info('TCP/IP: %s', self.server_address)
+
+    def _serve(self):
+        """Wait for new connections and incoming data. Runs in a thread."""
+        while not self.should_stop:
+            timeout = ClickerServer.POLL_INTERVAL
+            if self.accept_paused_until is not None:
+                remaining = self.accept_paused_until - time.monotonic()
+                if remaining <= 0:
+                    self.selector.register(self.listening_socket, selectors.EVENT_READ)
+                    self.accept_paused_until = None
+                else:
+                    timeout = min(timeout, remaining)
+
+            for key, events in self.selector.select(timeout):
+                connection = key.data
+                if connection is None:
+                    self._accept()
+                    continue
+
+                if events & selectors.EVENT_WRITE:
+                    self._write(connection)
+                # The connection may have been closed by the write
+                if events & selectors.EVENT_READ and connection.connection.fileno() != -1:
+                    self._read(connection)
+
+            # Checked once per loop, the buffers fill only with slow clients
+            # so waiting for the next select is fine
+            self._watch_outgoing()
+
+    def _accept(self):
+        while self.accept_paused_until is None:
+            try:
+                sock, client_address = self.listening_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self.logger.info('Accepting a connection failed')
+                return
+
+            sock.setblocking(False)
+            connection = ClickerConnection(self, sock, client_address)
+            self.selector.register(sock, selectors.EVENT_READ, connection)
+            self.logger.info('Connected %s', client_address)
+            self.register_connection(connection)
+
+            if self.accept_interval:
+                # Leave the other connections in the backlog for now
+                self.selector.unregister(self.listening_socket)
+                self.accept_paused_until = time.monotonic() + self.accept_interval
+
+    def _read(self, connection):
+        try:
+            data = connection.connection.recv(4096)
+        except ConnectionResetError:
+            self.logger.info('Connection reset error %s', connection.client_address)
+            data = b''
+        except OSError:
+            self.logger.info('OSError %s', connection.client_address)
+            data = b''
+
+        if not data:
+            self._close_connection(connection)
+        elif not connection.data_received(data):
+            self.logger.info('Line too long from %s', connection.client_address)
+            self._close_connection(connection)
+
+    def _watch_outgoing(self):
+        """Wait for writable sockets of the connections with outgoing data.
+
+        Connections with too much outgoing data are closed.
+        """
+        with self.outgoing_lock:
+            pending, self.outgoing_pending = self.outgoing_pending, set()
+
+        for connection in pending:
+            if connection.connection.fileno() == -1:
+                # Closed meanwhile
+                continue
+            if self._outgoing_overflow(connection):
+                continue
+            self.selector.modify(connection.connection,
+                                 selectors.EVENT_READ | selectors.EVENT_WRITE,
+                                 connection)
+
+    def _outgoing_overflow(self, connection):
+        """Close the connection if its outgoing buffer is over the limit."""
+        outgoing = connection.outgoing
+        if outgoing is None or len(outgoing) <= ClickerConnection.MAX_OUTGOING:
+            return False
+
+        self.logger.info('Client %s does not read', connection.client_address)
+        self._close_connection(connection)
+        return True
+
+    def _write(self, connection):
+        try:
+            flushed = connection.flush()
+        except OSError:
+            self.logger.info('OSError %s', connection.client_address)
+            self._close_connection(connection)
+            return
+
+        if flushed:
+            self.selector.modify(connection.connection, selectors.EVENT_READ,
+                                 connection)
+        else:
+            self._outgoing_overflow(connection)
+
+    def _close_connection(self, connection):
+        self.selector.unregister(connection.connection)
+        self.deregister_connection(connection)
+        connection.connection.close()
+        self.logger.info('Disconnected %s', connection.client_address)
 
     def message_reader(self):
 
@@ -139,16 +325,33 @@ class ClickerServer:
             self.server_messaging.server_wait(timeout=0.1)
 
     def send_message(self, message_from_gui):
-        ip, message = message_from_gui
-        self.logger.debug('Sending a message "%s" to %s', message, ip)
+        address, message = message_from_gui
+        self.logger.debug('Sending a message "%s" to %s', message, address)
 
         with self.connections_lock:
+            connection = self.connections.get(address)
+
+        # Sent without the lock, the server thread needs it for new connections
+        if connection:
+            connection.send_message(message)
+
+        tracing.stamp('send_message')
+        tracing.finish()
+
+    def send_messages(self, messages_from_gui):
+        """Send a batch of (address, message) pairs."""
+        self.logger.debug('Sending %i messages', len(messages_from_gui))
+
+        with self.connections_lock:
+            replies = [(self.connections.get(address), message)
+                       for address, message in messages_from_gui]
+
+        for connection, message in replies:
+            if connection:
+                connection.send_message(message)
 
-            # Iterate reversed because there might be old connections at the front
-            for connection in reversed(self.connections):
-                if ip == connection.client_address[0]:
-                    connection.send_message(message)
-                    break
+        tracing.stamp('send_message')
+        tracing.finish()
 
     def register_connection(self, connection):
         """Register a connection with the ClickerServer.
@@ -157,9 +360,15 @@ class ClickerServer:
         application logic can send messages to the clients.
         """
         with self.connections_lock:
-            self.connections.append(connection)
-            self.server_messaging.server_post(
-                'connected', connection.client_address[0])
+            self.connections[connection.client_address] = connection
+            if self.capture:
+                self.capture.connect(connection.client_address)
+
+        # Posted without the lock, posting may block when the queue is full.
+        # The key lets deregister_connection() cancel the event.
+        self.server_messaging.server_post(
+            'connected', connection.client_address,
+            merge_key=connection.client_address)
 
     def deregister_connection(self, connection):
         """Remove the client registration.
@@ -167,47 +376,68 @@ class ClickerServer:
         The clients remove themselves after the connection is closed.
         """
         with self.connections_lock:
-            self.connections.remove(connection)
-            self.server_messaging.server_post(
-                'disconnected', connection.client_address[0])
+            del self.connections[connection.client_address]
+            if self.capture:
+                self.capture.disconnect(connection.client_address)
+
+        # A client that disconnects before the GUI takes its 'connected' event
+        # is not greeted. This sheds the connect storms of flapping clients.
+        self.server_messaging.server_cancel(
+            'connected', connection.client_address)
+        self.server_messaging.server_post(
+            'disconnected', connection.client_address)
 
     def stop(self):
-        """Finalize the server."""
+        """Finalize the server.
+
+        The GUI is not expected to read the messages any more, so the events
+        of the closed connections are not passed to it.
+        """
 
         self.should_stop = True
-        self.server.shutdown()
-        self.server.server_close()
+        self.server_messaging.shutdown()
+        if self.selector:
+            self.server_thread.join()
 
-        for connection in self.connections:
-            try:
-                connection.connection.shutdown(1)
-            except Exception:
-                # Ignore errors and try to close all connections
-                pass
+            for connection in list(self.connections.values()):
+                try:
+                    self._close_connection(connection)
+                except Exception:
+                    # Ignore errors and try to close all connections
+                    pass
+
+            self.selector.close()
+            self.listening_socket.close()
+
+        self.server_checking_thread.join()
 
     def broadcast(self, message):
         """Send a message to all connected clients."""
         self.logger.debug('Broadcasting: "%s"', message)
 
         with self.connections_lock:
-            if not self.connections:
-                self.logger.debug('Broadcasting a message but there are no '
-                                  'active connections')
+            connections = list(self.connections.values())
 
-            for connection in self.connections:
-                try:
-                    connection.send_message(message)
-                except ConnectionError:
-                    pass
+        if not connections:
+            self.logger.debug('Broadcasting a message but there are no '
+                              'active connections')
+
+        for connection in connections:
+            connection.send_message(message)
 
-    def handle_message(self, ip, message):
+    def handle_message(self, address, message):
         """Handle the message sent by a client.
 
         This is a callback that is called by the TCP client after a message is
-        received.
+        received. A message equal to one from the same client that is still
+        waiting in the queue (e.g. a repeated vote) is dropped.
         """
-        self.logger.info('Handling message from %s: "%s"', ip, message)
-        self.server_messaging.server_post('received', (ip, message))
+        tracing.stamp('handle_message')
+        self.logger.info('Handling message from %s: "%s"', address, message)
+        if self.capture:
+            self.capture.data(address, message)
+        self.server_messaging.server_post('received', (address, message),
+                                          merge_key=(address, message))
 
     def connected_clients_count(self):
         """Return the number of connected clients."""
@@ -1,15 +1,51 @@
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
+import collections
 import logging
+import threading
+
+from . import tracing
 
 class ServerMessaging:
-    def __init__(self):
+
+    """Period of checking whether the messaging was shut down while a post
+    waits for a full queue, in seconds."""
+    SHUTDOWN_CHECK_INTERVAL = 0.1
+
+    def __init__(self, synchronous=False, gui_queue_size=0, server_queue_size=0):
+        """Create the messaging between the server and the GUI.
+
+        In the synchronous mode the messages are not queued, the callbacks are
+        called directly from the posting thread. This gives deterministic
+        ordering for tests and benchmarks that run without the GUI thread.
+
+        The queues hold at most gui_queue_size and server_queue_size messages
+        (0 means unbounded). Posting to a full queue blocks the posting thread
+        until the other side catches up. For the server that means it stops
+        reading the sockets, so the clients are slowed down by TCP. After
+        shutdown() the messages to the GUI are dropped instead.
+        """
         self.logger = logging.getLogger('Server messaging')
-        self.gui_queue = Queue()
+        self.synchronous = synchronous
+
+        self.gui_queue = Queue(gui_queue_size)
         self.gui_callbacks = {}
+        self.gui_batch_callbacks = {}
 
-        self.server_queue = Queue()
+        self.server_queue = Queue(server_queue_size)
         self.server_callbacks = {}
 
+        # Number of queued messages per subject and number of messages
+        # dropped because an equal message was already queued
+        self.counters_lock = threading.Lock()
+        self.gui_queue_depths = collections.Counter()
+        self.server_queue_depths = collections.Counter()
+        self.shed_counts = collections.Counter()
+        self.pending_keys = set()
+        # Keys of queued messages that are dropped when taken from the queue
+        self.cancelled_keys = collections.Counter()
+
+        self.is_shut_down = False
+
     def server_register_callback(self, subject, callback):
         self.logger.debug('Server registered a callback "%s"', subject)
         self.server_callbacks[subject] = callback
@@ -17,38 +53,172 @@ class ServerMessaging:
     def server_check(self):
         try:
             while True:
-                subject, message = self.server_queue.get_nowait()
-                self.server_callbacks[subject](message)
+                self._server_dispatch(*self.server_queue.get_nowait())
         except Empty:
             pass
 
     def server_wait(self, timeout=None):
         try:
-            subject, message = self.server_queue.get(timeout=timeout)
-            self.server_callbacks[subject](message)
+            self._server_dispatch(*self.server_queue.get(timeout=timeout))
         except Empty:
             pass
 
-    def server_post(self, subject, message):
+    def _server_dispatch(self, subject, message, span):
+        with self.counters_lock:
+            self.server_queue_depths[subject] -= 1
+
+        # The span of a traced message is current while its callback runs
+        tracing.activate(span)
+        tracing.stamp('server_check')
+        self.server_callbacks[subject](message)
+        tracing.activate(None)
+
+    def server_post(self, subject, message, merge_key=None):
+        """Post a message to the GUI.
+
+        If merge_key is given and a message with the same subject and key is
+        still waiting in the queue, the new message is dropped. Return False
+        if the message was dropped.
+        """
         self.logger.debug('Server posted a message "%s"', subject)
-        self.gui_queue.put((subject, message))
+        tracing.stamp('server_post')
+        if self.synchronous:
+            self._gui_dispatch(subject, [message])
+            return True
+        if self.is_shut_down:
+            return False
+
+        key = None if merge_key is None else (subject, merge_key)
+        with self.counters_lock:
+            if key is not None:
+                if key in self.pending_keys:
+                    self.shed_counts[subject] += 1
+                    return False
+                self.pending_keys.add(key)
+            self.gui_queue_depths[subject] += 1
+
+        # Wait for the GUI, but not after it has stopped reading the queue
+        item = (subject, message, tracing.current(), key)
+        while not self.is_shut_down:
+            try:
+                self.gui_queue.put(item, timeout=ServerMessaging.SHUTDOWN_CHECK_INTERVAL)
+                return True
+            except Full:
+                pass
+
+        with self.counters_lock:
+            self.gui_queue_depths[subject] -= 1
+            self.pending_keys.discard(key)
+        return False
+
+    def shutdown(self):
+        """Stop passing messages to the GUI.
+
+        Called when the GUI does not read the queue any more. The following
+        server posts, and the posts waiting for a full queue, are dropped so
+        that the server can finish.
+        """
+        self.is_shut_down = True
+
+    def server_cancel(self, subject, merge_key):
+        """Drop the queued message posted with the subject and merge_key.
+
+        Return False if there is no such message waiting in the queue.
+        """
+        key = (subject, merge_key)
+        with self.counters_lock:
+            if key not in self.pending_keys:
+                return False
+            self.pending_keys.discard(key)
+            self.cancelled_keys[key] += 1
+            self.shed_counts[subject] += 1
+        return True
 
     def gui_register_callbacks(self, subject, callback):
         self.logger.debug('GUI registered a callback "%s"', subject)
         self.gui_callbacks[subject] = callback
 
+    def gui_register_batch_callbacks(self, subject, callback):
+        """Register a callback that gets a list of messages.
+
+        Consecutive queued messages of the subject are passed to the callback
+        in a single call.
+        """
+        self.logger.debug('GUI registered a batch callback "%s"', subject)
+        self.gui_batch_callbacks[subject] = callback
+
     def gui_deregister_callbacks(self, subject):
         self.logger.debug('GUI deregistered a callback "%s"', subject)
-        del self.gui_callbacks[subject]
+        self.gui_callbacks.pop(subject, None)
+        self.gui_batch_callbacks.pop(subject, None)
 
     def gui_check(self):
+        batch_subject = None
+        batch = []
+        batch_spans = []
+
         try:
             while True:
-                subject, message = self.gui_queue.get_nowait()
-                self.gui_callbacks[subject](message)
+                subject, message, span, key = self.gui_queue.get_nowait()
+                with self.counters_lock:
+                    self.gui_queue_depths[subject] -= 1
+                    if self.cancelled_keys[key]:
+                        self.cancelled_keys[key] -= 1
+                        if not self.cancelled_keys[key]:
+                            del self.cancelled_keys[key]
+                        continue
+                    self.pending_keys.discard(key)
+
+                if subject != batch_subject and batch:
+                    self._gui_dispatch(batch_subject, batch, tracing.group(batch_spans))
+                    batch = []
+                    batch_spans = []
+
+                if subject in self.gui_batch_callbacks:
+                    batch_subject = subject
+                    batch.append(message)
+                    # All traced messages of the batch are traced together
+                    if span is not None:
+                        batch_spans.append(span)
+                else:
+                    batch_subject = None
+                    self._gui_dispatch(subject, [message], span)
         except Empty:
             pass
 
+        if batch:
+            self._gui_dispatch(batch_subject, batch, tracing.group(batch_spans))
+
+    def _gui_dispatch(self, subject, messages, span=None):
+        if span is not None:
+            tracing.activate(span)
+            tracing.stamp('gui_check')
+
+        if subject in self.gui_batch_callbacks:
+            self.gui_batch_callbacks[subject](messages)
+        else:
+            for message in messages:
+                self.gui_callbacks[subject](message)
+
+        if span is not None:
+            tracing.activate(None)
+
     def gui_post(self, subject, message):
         self.logger.debug('GUI posted a message "%s"', subject)
-        self.server_queue.put((subject, message))
+        tracing.stamp('gui_post')
+        if self.synchronous:
+            self.server_callbacks[subject](message)
+            return
+
+        with self.counters_lock:
+            self.server_queue_depths[subject] += 1
+        self.server_queue.put((subject, message, tracing.current()))
+
+    def queue_depths(self):
+        """Return the numbers of queued messages per subject.
+
+        The result is a dict {'gui': {subject: depth}, 'server': {...}}.
+        """
+        with self.counters_lock:
+            return {'gui': dict(self.gui_queue_depths),
+                    'server': dict(self.server_queue_depths)}
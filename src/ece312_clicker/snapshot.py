@@ -0,0 +1,198 @@
+"""Server state snapshots.
+
+Serializes the active poll into a compact binary file so that the server can
+be restarted (upgrade, crash) without forgetting the running poll.
+
+Both the encoding and the decoding take about 0.8 s for 1M voters, so the
+server saves the snapshot only when the poll has changed.
+
+The file layout is a fixed header followed by the poll (if one is active):
+
+    magic (4 bytes), version (uint8), flags (uint8)
+    question, answer count (uint16), answers, votes (uint32 per answer),
+    voter count (uint32), voters (device ID and IP each)
+
+Strings are stored as uint16 length followed by UTF-8 bytes, a missing device
+ID is an empty string. All integers are little endian. Version 1 files
+(voters are IP addresses only) and version 2 files (with the parameters of
+the removed voter filter before the voter count) can still be read.
+"""
+
+import os
+import struct
+
+from .poll import Poll
+
+MAGIC = b'ECSN'
+VERSION = 3
+
+FLAG_POLL_ACTIVE = 0x01
+
+_HEADER = struct.Struct('<4sBB')
+_UINT16 = struct.Struct('<H')
+_UINT32 = struct.Struct('<I')
+_DOUBLE = struct.Struct('<d')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _pack_string(text):
+    data = text.encode('utf-8')
+    return _UINT16.pack(len(data)) + data
+
+
+class _Reader:
+    """Sequential reader over the snapshot bytes."""
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        try:
+            values = fmt.unpack_from(self.data, self.offset)
+        except struct.error as e:
+            raise SnapshotError('Truncated snapshot') from e
+        self.offset += fmt.size
+        return values
+
+    def string(self):
+        length, = self.unpack(_UINT16)
+        end = self.offset + length
+        if end > len(self.data):
+            raise SnapshotError('Truncated snapshot')
+        try:
+            text = self.data[self.offset:end].decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise SnapshotError('Invalid string in the snapshot') from e
+        self.offset = end
+        return text
+
+    def strings(self, count):
+        """Read count strings, the same as count calls of string()."""
+        # A single loop over local variables, the voters are read with it
+        data, offset, size = self.data, self.offset, len(self.data)
+        texts = []
+        append = texts.append
+        try:
+            for _ in range(count):
+                end = offset + 2 + (data[offset] | data[offset + 1] << 8)
+                if end > size:
+                    raise SnapshotError('Truncated snapshot')
+                append(data[offset + 2:end].decode('utf-8'))
+                offset = end
+        except IndexError as e:
+            raise SnapshotError('Truncated snapshot') from e
+        except UnicodeDecodeError as e:
+            raise SnapshotError('Invalid string in the snapshot') from e
+
+        self.offset = offset
+        return texts
+
+
+def dumps(poll):
+    """Encode the state (the active poll or None) to bytes."""
+    if poll is None:
+        return _HEADER.pack(MAGIC, VERSION, 0)
+
+    parts = [_HEADER.pack(MAGIC, VERSION, FLAG_POLL_ACTIVE),
+             _pack_string(poll.question),
+             _UINT16.pack(len(poll.answers))]
+    parts.extend(_pack_string(answer) for answer in poll.answers)
+    parts.extend(_UINT32.pack(poll.get_votes(n))
+                 for n in range(len(poll.answers)))
+    parts.append(_UINT32.pack(len(poll.registered_voters)))
+    pack_length = _UINT16.pack
+    for device_id, ip in poll.registered_voters:
+        device_id = (device_id or '').encode('utf-8')
+        ip = ip.encode('utf-8')
+        parts.append(pack_length(len(device_id)) + device_id
+                     + pack_length(len(ip)) + ip)
+
+    return b''.join(parts)
+
+
+def loads(data):
+    """Decode the bytes created by dumps(). Return the poll or None.
+
+    Raise SnapshotError if the data is not a valid snapshot.
+    """
+    reader = _Reader(data)
+    magic, version, flags = reader.unpack(_HEADER)
+
+    if magic != MAGIC:
+        raise SnapshotError('Not a snapshot file')
+    if version not in (1, 2, VERSION):
+        raise SnapshotError('Unsupported snapshot version {}'.format(version))
+
+    if not flags & FLAG_POLL_ACTIVE:
+        return None
+
+    question = reader.string()
+    answer_count, = reader.unpack(_UINT16)
+    answers = [reader.string() for _ in range(answer_count)]
+    votes = [reader.unpack(_UINT32)[0] for _ in range(answer_count)]
+
+    if version == 2:
+        # Expected voters and false positive rate of the voter filter
+        reader.unpack(_UINT32)
+        reader.unpack(_DOUBLE)
+
+    voter_count, = reader.unpack(_UINT32)
+    if version == 1:
+        voters = [(None, ip) for ip in reader.strings(voter_count)]
+    else:
+        texts = reader.strings(2 * voter_count)
+        voters = [(device_id or None, ip)
+                  for device_id, ip in zip(texts[0::2], texts[1::2])]
+
+    try:
+        poll = Poll(question, answers)
+    except ValueError as e:
+        raise SnapshotError('Invalid poll in the snapshot: {}'.format(e)) from e
+
+    for choice, count in zip(poll.choices, votes):
+        poll.votes[choice] = count
+    poll.registered_voters.update(voters)
+
+    return poll
+
+
+def state_key(poll):
+    """Return a value that changes when the snapshot of the poll changes.
+
+    The voters are only ever added, so their number tells whether they
+    changed. Comparing the keys spares the encoding of an unchanged poll.
+    """
+    if poll is None:
+        return None
+    return (poll, tuple(poll.votes.values()), len(poll.registered_voters))
+
+
+def save_snapshot(filename, poll):
+    """Write the snapshot atomically.
+
+    The data is written to a temporary file first and then moved over the old
+    snapshot so that a crash during writing never leaves a broken file.
+    """
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as f:
+        f.write(dumps(poll))
+    os.replace(temp_filename, filename)
+
+
+def load_snapshot(filename):
+    """Read the snapshot written by save_snapshot().
+
+    Return the restored poll or None if there was no active poll or there is
+    no snapshot file. Raise SnapshotError if the file is not a valid snapshot.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    return loads(data)
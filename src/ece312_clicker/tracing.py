@@ -0,0 +1,185 @@
+"""Latency tracing of the vote pipeline.
+
+A sampled message gets a span that collects monotonic timestamps of the
+stages it passes:
+
+    handle -> server_post -> gui_check -> on_data -> vote -> gui_post
+    -> server_check -> send_message
+
+The span travels with the message through ServerMessaging and is the
+"current span" of the thread while the callbacks handle the message, so the
+stages do not need to pass it around. When messages are handled in a batch,
+the spans of all sampled messages of the batch are current as a SpanGroup. Finished spans are aggregated into
+per-stage latency histograms and can be exported to a Chrome trace (JSON),
+which can be opened in chrome://tracing or Perfetto.
+
+Tracing is disabled by default; enable() turns it on for every n-th message.
+"""
+
+import collections
+import itertools
+import json
+import threading
+import time
+
+_local = threading.local()
+
+_tracer = None
+
+
+class Span:
+    """Timestamps of the stages of a single message."""
+
+    __slots__ = ('id', 'stamps')
+
+    def __init__(self, span_id):
+        self.id = span_id
+        self.stamps = [('start', time.monotonic())]
+
+    def stamp(self, stage):
+        self.stamps.append((stage, time.monotonic()))
+
+
+class SpanGroup:
+    """The spans of the messages handled together in a batch."""
+
+    __slots__ = ('spans',)
+
+    def __init__(self, spans):
+        self.spans = spans
+
+    def stamp(self, stage):
+        timestamp = time.monotonic()
+        for span in self.spans:
+            span.stamps.append((stage, timestamp))
+
+
+class Tracer:
+    """Samples messages and aggregates the latencies of the stages."""
+
+    def __init__(self, sample_every=100, keep_spans=10000):
+        self.sample_every = sample_every
+        self.message_counter = itertools.count()
+        self.span_counter = itertools.count()
+
+        self.lock = threading.Lock()
+        self.spans = collections.deque(maxlen=keep_spans)
+        # Histograms of the latency from the previous stage, in power of two
+        # microsecond buckets: {stage: {bucket: count}}
+        self.histograms = collections.defaultdict(collections.Counter)
+
+    def begin(self):
+        """Return a new span for a sampled message, None otherwise."""
+        if next(self.message_counter) % self.sample_every:
+            return None
+        return Span(next(self.span_counter))
+
+    def finish(self, span):
+        with self.lock:
+            self.spans.append(span)
+            for (_, previous), (stage, timestamp) in zip(span.stamps, span.stamps[1:]):
+                microseconds = int((timestamp - previous) * 1e6)
+                self.histograms[stage][microseconds.bit_length()] += 1
+
+    def histogram_table(self):
+        """Return the histograms as text, one line per stage and bucket."""
+        lines = []
+        with self.lock:
+            for stage, histogram in self.histograms.items():
+                for bucket in sorted(histogram):
+                    lines.append('{:14} < {:9} us {:8}'.format(
+                        stage, 2 ** bucket, histogram[bucket]))
+        return '\n'.join(lines)
+
+    def export_chrome_trace(self, filename):
+        """Write the kept spans to a file in the Chrome trace format."""
+        events = []
+        with self.lock:
+            for span in self.spans:
+                for (_, start), (stage, end) in zip(span.stamps, span.stamps[1:]):
+                    events.append({
+                        'name': stage, 'cat': 'vote', 'ph': 'X',
+                        'ts': start * 1e6, 'dur': (end - start) * 1e6,
+                        'pid': 1, 'tid': span.id})
+
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+
+
+def enable(sample_every=100, keep_spans=10000):
+    """Enable the tracing of every sample_every-th message."""
+    global _tracer
+    _tracer = Tracer(sample_every, keep_spans)
+    return _tracer
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def get_tracer():
+    return _tracer
+
+
+# All functions below return right away when the tracing is disabled, so the
+# disabled tracing costs a function call per stage
+
+
+def begin():
+    """Start a span for a new message in this thread if it is sampled."""
+    if _tracer is None:
+        return
+    _local.span = _tracer.begin()
+
+
+def current():
+    """Return the span of the message handled by this thread or None."""
+    if _tracer is None:
+        return None
+    return getattr(_local, 'span', None)
+
+
+def group(spans):
+    """Return the span for a batch of messages with the spans.
+
+    That is None if no message of the batch is sampled, the span of the only
+    sampled message or a SpanGroup.
+    """
+    if not spans:
+        return None
+    if len(spans) == 1:
+        return spans[0]
+    return SpanGroup(spans)
+
+
+def activate(span):
+    """Make the span (or SpanGroup) current in this thread, None clears it."""
+    if _tracer is None:
+        return
+    _local.span = span
+
+
+def stamp(stage):
+    """Record the time of the stage in the current span."""
+    if _tracer is None:
+        return
+    span = getattr(_local, 'span', None)
+    if span is not None:
+        span.stamp(stage)
+
+
+def finish():
+    """Finish the current span and aggregate its latencies."""
+    if _tracer is None:
+        return
+    span = getattr(_local, 'span', None)
+    if span is None:
+        return
+
+    _local.span = None
+    if isinstance(span, SpanGroup):
+        for member in span.spans:
+            _tracer.finish(member)
+    else:
+        _tracer.finish(span)
@@ -0,0 +1,44 @@
+from ece312_clicker.capture import (CaptureWriter, read_capture, EVENT_CONNECT,
+                                    EVENT_DATA, EVENT_DISCONNECT)
+from ece312_clicker.replay import replay_in_process
+
+
+def write_capture(filename):
+    capture = CaptureWriter(filename)
+    for n in range(3):
+        capture.connect(('10.0.0.{}'.format(n), 5000))
+    capture.data(('10.0.0.0', 5000), 'A')
+    capture.data(('10.0.0.1', 5000), 'ID device-1')
+    capture.data(('10.0.0.1', 5000), 'B')
+    capture.data(('10.0.0.2', 5000), 'B')
+    capture.data(('10.0.0.2', 5000), 'C')
+    for n in range(3):
+        capture.disconnect(('10.0.0.{}'.format(n), 5000))
+    capture.close()
+
+
+def test_capture(tmpdir):
+    filename = str(tmpdir.join('traffic.capture'))
+    write_capture(filename)
+
+    records = list(read_capture(filename))
+    assert [(event, connection, payload)
+            for _, event, connection, payload in records[:4]] == [
+        (EVENT_CONNECT, 0, '10.0.0.0'),
+        (EVENT_CONNECT, 1, '10.0.0.1'),
+        (EVENT_CONNECT, 2, '10.0.0.2'),
+        (EVENT_DATA, 0, 'A')]
+    assert records[-1][1:] == (EVENT_DISCONNECT, 2, '')
+
+    timestamps = [record[0] for record in records]
+    assert timestamps == sorted(timestamps)
+
+
+def test_replay(tmpdir):
+    filename = str(tmpdir.join('traffic.capture'))
+    write_capture(filename)
+
+    poll = replay_in_process(read_capture(filename), speed=0)
+
+    assert [poll.get_votes(n) for n in range(3)] == [1, 2, 0]
+    assert poll.ip_voted('10.0.0.1', 'device-1')
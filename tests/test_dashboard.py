@@ -0,0 +1,56 @@
+import json
+import socket
+
+import pytest
+
+from ece312_clicker.dashboard import DashboardServer
+from ece312_clicker.poll import Poll
+
+
+class PollSource:
+    def __init__(self):
+        self.poll = None
+
+    def __call__(self):
+        return self.poll
+
+
+@pytest.fixture
+def dashboard():
+    source = PollSource()
+    dashboard = DashboardServer('localhost', 0, source, frame_rate=100)
+    yield dashboard, source
+    dashboard.stop()
+
+
+def subscribe(dashboard):
+    subscriber = socket.create_connection(dashboard.server_address)
+    subscriber.settimeout(2)
+    return subscriber, subscriber.makefile('r')
+
+
+def test_live_results(dashboard):
+    dashboard, source = dashboard
+    subscriber, lines = subscribe(dashboard)
+
+    with subscriber:
+        assert json.loads(lines.readline()) == {'type': 'inactive'}
+
+        poll = Poll('Question?', ['A1', 'B2', 'C3'])
+        poll.register_vote_updated_callback(lambda: None)
+        source.poll = poll
+        assert json.loads(lines.readline()) == {
+            'type': 'poll', 'question': 'Question?',
+            'answers': ['A1', 'B2', 'C3'], 'votes': [0, 0, 0]}
+
+        poll.vote('10.0.0.1', 'A')
+        poll.vote('10.0.0.2', 'A')
+        assert json.loads(lines.readline()) == {'type': 'delta', 'votes': {'A': 2}}
+
+        # A late subscriber gets the current state
+        late_subscriber, late_lines = subscribe(dashboard)
+        with late_subscriber:
+            assert json.loads(late_lines.readline())['votes'] == [2, 0, 0]
+
+        source.poll = None
+        assert json.loads(lines.readline()) == {'type': 'inactive'}
@@ -0,0 +1,196 @@
+import pytest
+
+from ece312_clicker.loopback import LoopbackConnection
+from ece312_clicker.poll import Poll
+from ece312_clicker.protocol import PollProtocol, create_poll_protocol
+from ece312_clicker.server import ClickerServer
+from ece312_clicker.server_messaging import ServerMessaging
+
+
+@pytest.fixture
+def clicker():
+    """Server and protocol wired the same way as in gui.main()."""
+    server_messaging = ServerMessaging(synchronous=True)
+    server = ClickerServer(None, None, server_messaging, listen=False)
+    server_messaging.server_register_callback('broadcast_message', server.broadcast)
+
+    poll_protocol = create_poll_protocol(server_messaging)
+
+    yield server, poll_protocol
+
+    server.stop()
+
+
+def open_poll(poll_protocol):
+    poll = Poll('Question?', ['A1', 'B2', 'C3'])
+    poll.register_vote_updated_callback(lambda: None)
+    poll_protocol.activate(poll)
+    return poll
+
+
+def test_inactive_poll(clicker):
+    server, poll_protocol = clicker
+
+    with LoopbackConnection(server, '10.0.0.1') as connection:
+        connection.send_line('A')
+        connection.send_line('1')
+
+    assert connection.received == ['inactive', 'inactive', 'error']
+
+
+def test_vote(clicker):
+    server, poll_protocol = clicker
+
+    with LoopbackConnection(server, '10.0.0.1') as connection:
+        open_poll(poll_protocol)
+        connection.send_line('B')
+        connection.send_line('C')
+
+    assert connection.received == ['inactive', 'active', 'OK', 'voted']
+
+
+def test_reconnect_after_vote(clicker):
+    server, poll_protocol = clicker
+    open_poll(poll_protocol)
+
+    with LoopbackConnection(server, '10.0.0.1') as connection:
+        connection.send_line('A')
+
+    with LoopbackConnection(server, '10.0.0.1') as connection:
+        pass
+
+    assert connection.received == ['voted']
+
+
+def test_many_voters(clicker):
+    server, poll_protocol = clicker
+    poll = open_poll(poll_protocol)
+
+    voters = 100000
+    for n in range(voters):
+        with LoopbackConnection(server, 'ip{}'.format(n)) as connection:
+            connection.send_line('ABC'[n % 3])
+            connection.send_line('A')
+        assert connection.received == ['active', 'OK', 'voted']
+
+    assert sum(poll.get_votes(n) for n in range(3)) == voters
+    assert server.connected_clients_count() == 0
+
+
+def test_poll_with_more_answers(clicker):
+    server, poll_protocol = clicker
+    poll = Poll('Question?', ['1', '2', '3', '4', '5'])
+    poll.register_vote_updated_callback(lambda: None)
+    poll_protocol.activate(poll)
+
+    with LoopbackConnection(server, '10.0.0.1') as first:
+        first.send_line('E')
+    with LoopbackConnection(server, '10.0.0.2') as second:
+        second.send_line('F')
+
+    assert first.received == ['active', 'OK']
+    assert second.received == ['active', 'error']
+    assert poll.get_votes(4) == 1
+
+
+def test_devices_behind_nat(clicker):
+    server, poll_protocol = clicker
+    poll = open_poll(poll_protocol)
+
+    with LoopbackConnection(server, '10.0.0.1') as first, \
+            LoopbackConnection(server, '10.0.0.1') as second:
+        first.send_line('ID device-1')
+        second.send_line('ID device-2')
+        first.send_line('A')
+        second.send_line('B')
+        second.send_line('B')
+
+    assert first.received == ['active', 'active', 'OK']
+    assert second.received == ['active', 'active', 'OK', 'voted']
+
+    # The device is recognized after reconnecting
+    with LoopbackConnection(server, '10.0.0.1') as connection:
+        connection.send_line('ID device-1')
+
+    assert connection.received == ['active', 'voted']
+    assert poll.get_votes('A') == 1
+    assert poll.get_votes('B') == 1
+
+
+def test_invalid_device_id(clicker):
+    server, poll_protocol = clicker
+
+    with LoopbackConnection(server, '10.0.0.1') as connection:
+        connection.send_line('ID ')
+        connection.send_line('ID two words')
+        connection.send_line('ID ' + 'x' * 65)
+
+    assert connection.received == ['inactive', 'error', 'error', 'error']
+
+
+def test_device_id_only_before_the_vote(clicker):
+    server, poll_protocol = clicker
+    poll = open_poll(poll_protocol)
+
+    with LoopbackConnection(server, '10.0.0.1') as connection:
+        connection.send_line('A')
+        for n in range(3):
+            connection.send_line('ID device-{}'.format(n))
+            connection.send_line('A')
+
+    with LoopbackConnection(server, '10.0.0.2') as connection:
+        connection.send_line('ID device-1')
+        connection.send_line('ID device-2')
+        connection.send_line('B')
+
+    assert poll.get_votes('A') == 1
+    assert poll.get_votes('B') == 1
+    assert connection.received == ['active', 'active', 'error', 'OK']
+
+
+def test_vote_many():
+    poll = Poll('Question?', ['A1', 'B2', 'C3'])
+    updates = []
+    poll.register_vote_updated_callback(lambda: updates.append(1))
+    poll.vote('10.0.0.1', 'A')
+
+    results = poll.vote_many(
+        ['10.0.0.1', '10.0.0.2', '10.0.0.2', '10.0.0.3', '10.0.0.2'],
+        ['B', 'B', 'C', 'D', 'A'],
+        [None, None, None, None, 'device-1'])
+
+    assert results == ['duplicate', 'accepted', 'duplicate', 'invalid', 'accepted']
+    assert [poll.get_votes(n) for n in range(3)] == [2, 1, 0]
+    assert poll.ip_voted('10.0.0.2', 'device-1')
+    assert len(updates) == 2
+
+
+def test_data_batch():
+    poll_protocol = PollProtocol(lambda address, message: None, lambda message: None)
+    first, second = ('10.0.0.1', 5000), ('10.0.0.1', 5001)
+
+    assert poll_protocol.on_data_batch([(first, 'A'), (second, 'X1')]) == [
+        (first, 'inactive'), (second, 'error')]
+
+    poll = Poll('Question?', ['A1', 'B2', 'C3'])
+    poll.register_vote_updated_callback(lambda: None)
+    poll_protocol.activate(poll)
+
+    assert poll_protocol.on_data_batch([
+        (first, 'A'), (second, 'ID device-1'), (second, 'B'), (first, 'C'),
+        (second, 'D')]) == [
+        (first, 'OK'), (second, 'active'), (second, 'OK'), (first, 'voted'),
+        (second, 'error')]
+
+    # The vote earlier in the batch counts
+    third = ('10.0.0.2', 5000)
+    assert poll_protocol.on_data_batch([
+        (third, 'A'), (third, 'ID device-2'), (third, 'B')]) == [
+        (third, 'OK'), (third, 'error'), (third, 'voted')]
+
+    # A blank line or a typo does not close the device ID
+    fourth = ('10.0.0.3', 5000)
+    assert poll_protocol.on_data_batch([
+        (fourth, ''), (fourth, 'a'), (fourth, 'ID device-3'), (fourth, 'A')]) == [
+        (fourth, 'error'), (fourth, 'error'), (fourth, 'active'), (fourth, 'OK')]
+    assert poll.ip_voted('10.0.0.3', 'device-3')
@@ -0,0 +1,36 @@
+import pytest
+
+from ece312_clicker.question_bank import QuestionBank
+
+
+@pytest.fixture
+def bank():
+    return QuestionBank.from_dict({
+        'What is your favorite bus?': ['I2C', 'SPI', 'UART', 'CAN'],
+        'Who is the best TA?': ['Mickey Mouse', 'Tomas', 'Brad Pitt'],
+        'What did you do on the reading week?': ['Skiing', 'Party'],
+    })
+
+
+def test_answers(bank):
+    assert bank.answers('Who is the best TA?') == ['Mickey Mouse', 'Tomas', 'Brad Pitt']
+    with pytest.raises(KeyError):
+        bank.answers('Missing?')
+
+
+def test_prefix_search(bank):
+    assert bank.search('what') == ['What did you do on the reading week?',
+                                   'What is your favorite bus?']
+    assert bank.search('', limit=1) == ['What did you do on the reading week?']
+
+
+def test_full_text_search(bank):
+    if not bank.full_text:
+        pytest.skip('FTS5 is not available')
+    assert bank.search('read') == ['What did you do on the reading week?']
+
+
+def test_replace_answers(bank):
+    bank.add('Who is the best TA?', ['Brad', 'Tomas'])
+    assert bank.answers('Who is the best TA?') == ['Brad', 'Tomas']
+    assert len(bank) == 3
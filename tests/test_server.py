@@ -1,22 +1,30 @@
-# Sample Test passing with nose and pytest
-
 import socket
+import threading
 import time
 
+from ece312_clicker.loopback import LoopbackConnection
 from ece312_clicker.server import ClickerServer
+from ece312_clicker.server_messaging import ServerMessaging
+
+
+def wait_for(condition, timeout=2.0):
+    """Wait until the condition is true. The server threads run on their own."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'Timed out'
+        time.sleep(0.001)
+
 
 def simple_client(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
         sock.connect(('localhost', port))
-        # sock.sendall(bytes(message, 'ascii'))
-        # response = str(sock.recv(1024), 'ascii')
-        # print("Received: {}".format(response))
+
 
 def test_server_starts():
 
     # Create the server on a random port
-    clickerServer = ClickerServer('localhost', 0)
-    port = clickerServer.server.server_address[1]
+    clickerServer = ClickerServer('localhost', 0, ServerMessaging())
+    port = clickerServer.server_address[1]
 
     # Try to connect to it
     simple_client(port)
@@ -24,25 +32,225 @@ def test_server_starts():
     clickerServer.stop()
     # Should not throw
 
+
 def test_server_registers_clients():
     # Create the server on a random port
-    clickerServer = ClickerServer('localhost', 0)
-    port = clickerServer.server.server_address[1]
+    clickerServer = ClickerServer('localhost', 0, ServerMessaging())
+    port = clickerServer.server_address[1]
+
+    try:
+        assert clickerServer.connected_clients_count() == 0
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock1:
+            sock1.connect(('localhost', port))
+            wait_for(lambda: clickerServer.connected_clients_count() == 1)
+
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock2:
+                sock2.connect(('localhost', port))
+                wait_for(lambda: clickerServer.connected_clients_count() == 2)
+
+            wait_for(lambda: clickerServer.connected_clients_count() == 1)
+
+        wait_for(lambda: clickerServer.connected_clients_count() == 0)
+    finally:
+        clickerServer.stop()
+
+
+def test_server_receives_messages():
+    server_messaging = ServerMessaging()
+    clickerServer = ClickerServer('localhost', 0, server_messaging)
+    port = clickerServer.server_address[1]
+
+    received = []
+    server_messaging.gui_register_callbacks('connected', lambda ip: None)
+    server_messaging.gui_register_callbacks('received', received.append)
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.connect(('localhost', port))
+            sock.sendall(b'A\n')
+
+            def check():
+                server_messaging.gui_check()
+                return received
+
+            wait_for(check)
+
+        (address, message), = received
+        assert address[0] == '127.0.0.1'
+        assert message == 'A'
+    finally:
+        clickerServer.stop()
+
+
+def test_full_queue_blocks_the_server():
+    server_messaging = ServerMessaging(gui_queue_size=1)
+    received = []
+    server_messaging.gui_register_callbacks('received', received.append)
+
+    server_messaging.server_post('received', 'first')
+
+    # The second post waits until the GUI takes the first message
+    second = threading.Thread(
+        target=server_messaging.server_post, args=('received', 'second'))
+    second.start()
+    second.join(0.05)
+    assert second.is_alive()
+    assert server_messaging.queue_depths()['gui'] == {'received': 2}
+
+    server_messaging.gui_check()
+    second.join(1)
+    assert not second.is_alive()
+    server_messaging.gui_check()
+
+    assert received == ['first', 'second']
+    assert server_messaging.queue_depths()['gui'] == {'received': 0}
+
+
+def test_stop_with_full_queue():
+    # The GUI does not read the queue any more when the server stops
+    server_messaging = ServerMessaging(gui_queue_size=2)
+    clickerServer = ClickerServer('localhost', 0, server_messaging)
+    port = clickerServer.server_address[1]
+
+    clients = []
+    try:
+        for _ in range(5):
+            clients.append(socket.create_connection(('localhost', port)))
+        # The server thread waits for the queue after the third client
+        wait_for(lambda: clickerServer.connected_clients_count() == 3)
+
+        stop = threading.Thread(target=clickerServer.stop)
+        stop.start()
+        stop.join(5)
+        assert not stop.is_alive()
+    finally:
+        for client in clients:
+            client.close()
+
+
+def test_repeated_messages_are_shed():
+    server_messaging = ServerMessaging()
+    received = []
+    server_messaging.gui_register_callbacks('received', received.append)
+
+    address = ('10.0.0.1', 5000)
+    assert server_messaging.server_post('received', (address, 'A'), merge_key=(address, 'A'))
+    assert not server_messaging.server_post('received', (address, 'A'), merge_key=(address, 'A'))
+    assert server_messaging.server_post('received', (address, 'B'), merge_key=(address, 'B'))
+    server_messaging.gui_check()
+
+    # Not queued any more, so it is not a duplicate
+    assert server_messaging.server_post('received', (address, 'A'), merge_key=(address, 'A'))
+    server_messaging.gui_check()
+
+    assert received == [(address, 'A'), (address, 'B'), (address, 'A')]
+    assert server_messaging.shed_counts == {'received': 1}
+
+
+def test_connect_storm_is_shed():
+    server_messaging = ServerMessaging()
+    clickerServer = ClickerServer(None, None, server_messaging, listen=False)
+    events = []
+    for subject in ('connected', 'disconnected'):
+        server_messaging.gui_register_callbacks(
+            subject, lambda address, subject=subject: events.append((subject, address)))
+
+    try:
+        # Clients that leave before the GUI greets them are not greeted
+        flapping = [LoopbackConnection(clickerServer, '10.0.0.1').connect()
+                    for _ in range(3)]
+        staying = LoopbackConnection(clickerServer, '10.0.0.2').connect()
+        for connection in flapping:
+            connection.disconnect()
+        server_messaging.gui_check()
+
+        assert events == [('connected', staying.client_address)] + [
+            ('disconnected', connection.client_address) for connection in flapping]
+        assert server_messaging.shed_counts == {'connected': 3}
+        assert server_messaging.queue_depths()['gui'] == {
+            'connected': 0, 'disconnected': 0}
+    finally:
+        clickerServer.stop()
+
+
+def test_batches_of_received_messages():
+    server_messaging = ServerMessaging()
+    calls = []
+    server_messaging.gui_register_batch_callbacks('received', calls.append)
+    server_messaging.gui_register_callbacks('connected', calls.append)
+
+    for subject, message in [('received', 1), ('received', 2), ('connected', 3),
+                             ('received', 4)]:
+        server_messaging.server_post(subject, message)
+    server_messaging.gui_check()
+
+    assert calls == [[1, 2], 3, [4]]
+
+
+def test_lines_split_across_packets():
+    server_messaging = ServerMessaging()
+    clickerServer = ClickerServer('localhost', 0, server_messaging)
+    port = clickerServer.server_address[1]
+
+    received = []
+    server_messaging.gui_register_callbacks('connected', lambda address: None)
+    server_messaging.gui_register_callbacks('disconnected', lambda address: None)
+    server_messaging.gui_register_callbacks(
+        'received', lambda message: received.append(message[1]))
+
+    def check(count):
+        server_messaging.gui_check()
+        return len(received) == count
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.connect(('localhost', port))
+            # The result is the same whether the parts arrive together or not
+            sock.sendall(b'I')
+            sock.sendall(b'D device-1\r\nA\nB')
+            wait_for(lambda: check(2))
+
+            # Too long line closes the connection
+            sock.sendall(b'x' * 2000)
+            wait_for(lambda: clickerServer.connected_clients_count() == 0)
+
+        # Also when its end comes in the same packet
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.connect(('localhost', port))
+            wait_for(lambda: clickerServer.connected_clients_count() == 1)
+            sock.sendall(b'x' * 2000 + b'\nC\n')
+            wait_for(lambda: clickerServer.connected_clients_count() == 0)
+
+        server_messaging.gui_check()
+        assert received == ['ID device-1', 'A']
+    finally:
+        clickerServer.stop()
+
 
-    assert clickerServer.connected_clients_count() == 0
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock1:
-        sock1.connect(('localhost', port))
-        time.sleep(0.01)
+def test_client_not_reading_is_disconnected():
+    server_messaging = ServerMessaging()
+    clickerServer = ClickerServer('localhost', 0, server_messaging)
+    port = clickerServer.server_address[1]
 
-        assert clickerServer.connected_clients_count() == 1
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as slow:
+            slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            slow.connect(('localhost', port))
+            wait_for(lambda: clickerServer.connected_clients_count() == 1)
 
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock2:
-            sock2.connect(('localhost', port))
-            time.sleep(0.01)
+            # The sends do not block, the data waits in the outgoing buffer
+            # until it is over the limit and the connection is closed
+            def flood():
+                clickerServer.broadcast('x' * 10000)
+                return clickerServer.connected_clients_count() == 0
 
-            assert clickerServer.connected_clients_count() == 2
-        time.sleep(0.01)
+            wait_for(flood, timeout=5.0)
 
-        assert clickerServer.connected_clients_count() == 1
-    time.sleep(0.01)
-    assert clickerServer.connected_clients_count() == 0
+            # The other clients are still served
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+                sock.connect(('localhost', port))
+                wait_for(lambda: clickerServer.connected_clients_count() == 1)
+                clickerServer.broadcast('Hello')
+                assert sock.recv(100) == b'Hello\n'
+    finally:
+        clickerServer.stop()
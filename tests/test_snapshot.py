@@ -0,0 +1,86 @@
+import struct
+
+import pytest
+
+from ece312_clicker.poll import Poll
+from ece312_clicker.snapshot import (dumps, loads, save_snapshot,
+                                     load_snapshot, state_key, SnapshotError)
+
+
+def test_snapshot_without_poll():
+    assert loads(dumps(None)) is None
+
+
+def test_snapshot_restores_poll(tmpdir):
+    poll = Poll('Question?', ['A1', 'B2', 'C3'])
+    poll.register_vote_updated_callback(lambda: None)
+    poll.vote('10.0.0.1', 'A')
+    poll.vote('10.0.0.2', 'C', device_id='device-1')
+
+    filename = str(tmpdir.join('state.bin'))
+    save_snapshot(filename, poll)
+    restored = load_snapshot(filename)
+
+    assert restored.question == 'Question?'
+    assert restored.answers == ['A1', 'B2', 'C3']
+    assert [restored.get_votes(n) for n in range(3)] == [1, 0, 1]
+    assert restored.ip_voted('10.0.0.1')
+    assert not restored.ip_voted('10.0.0.3')
+    assert restored.ip_voted('10.0.0.2', 'device-1')
+    assert not restored.ip_voted('10.0.0.2')
+
+
+def test_missing_snapshot(tmpdir):
+    assert load_snapshot(str(tmpdir.join('missing.bin'))) is None
+
+
+def test_invalid_snapshot():
+    with pytest.raises(SnapshotError):
+        loads(b'garbage')
+
+
+def test_version_2_snapshot():
+    def string(text):
+        return struct.pack('<H', len(text)) + text.encode()
+
+    # Version 2 has the parameters of the removed voter filter
+    data = (struct.pack('<4sBB', b'ECSN', 2, 1) + string('Question?')
+            + struct.pack('<H', 2) + string('A1') + string('B2')
+            + struct.pack('<II', 1, 0) + struct.pack('<Id', 1000, 0.01)
+            + struct.pack('<I', 1) + string('device-1') + string('10.0.0.1'))
+    poll = loads(data)
+
+    assert poll.answers == ['A1', 'B2']
+    assert [poll.get_votes(n) for n in range(2)] == [1, 0]
+    assert poll.ip_voted('10.0.0.1', 'device-1')
+
+
+def test_corrupt_snapshot(tmpdir):
+    data = dumps(Poll('Question?', ['A1', 'B2']))
+
+    # Invalid UTF-8 in the question
+    with pytest.raises(SnapshotError):
+        loads(data.replace(b'Question?', b'Question\xff'))
+
+    # Answer count out of range
+    with pytest.raises(SnapshotError):
+        loads(data.replace(b'\x02\x00\x02\x00A1', b'\x01\x00\x02\x00A1'))
+
+    filename = str(tmpdir.join('state.bin'))
+    with open(filename, 'wb') as f:
+        f.write(data[:-3])
+    with pytest.raises(SnapshotError):
+        load_snapshot(filename)
+
+
+def test_state_key_changes_with_the_poll():
+    poll = Poll('Question?', ['A1', 'B2'])
+    poll.register_vote_updated_callback(lambda: None)
+    key = state_key(poll)
+
+    assert state_key(poll) == key
+    assert state_key(Poll('Question?', ['A1', 'B2'])) != key
+    assert state_key(None) != key
+
+    poll.vote('10.0.0.1', 'A')
+    assert state_key(poll) != key
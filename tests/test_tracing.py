@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from ece312_clicker import tracing
+from ece312_clicker.loopback import LoopbackConnection
+from ece312_clicker.poll import Poll
+from ece312_clicker.protocol import create_poll_protocol
+from ece312_clicker.server import ClickerServer
+from ece312_clicker.server_messaging import ServerMessaging
+
+
+@pytest.fixture
+def tracer():
+    yield tracing.enable(sample_every=2)
+    tracing.disable()
+
+
+def test_vote_is_traced(tracer, tmpdir):
+    server_messaging = ServerMessaging(synchronous=True)
+    server = ClickerServer(None, None, server_messaging, listen=False)
+    server_messaging.server_register_callback('broadcast_message', server.broadcast)
+    poll_protocol = create_poll_protocol(server_messaging)
+
+    poll = Poll('Question?', ['A1', 'B2', 'C3'])
+    poll.register_vote_updated_callback(lambda: None)
+    poll_protocol.activate(poll)
+
+    for n in range(10):
+        with LoopbackConnection(server, 'ip{}'.format(n)) as connection:
+            connection.send_line('A')
+    server.stop()
+
+    # Every second message is sampled
+    assert len(tracer.spans) == 5
+    stages = [stage for stage, _ in tracer.spans[0].stamps]
+    assert stages == ['start', 'handle_message', 'server_post', 'on_data',
+                      'vote', 'gui_post', 'send_message']
+    assert sum(tracer.histograms['vote'].values()) == 5
+
+    filename = str(tmpdir.join('trace.json'))
+    tracer.export_chrome_trace(filename)
+    with open(filename) as f:
+        events = json.load(f)['traceEvents']
+    assert len(events) == 5 * 6
+    assert all(event['ph'] == 'X' and event['dur'] >= 0 for event in events)
+
+
+def test_queued_message_is_traced(tracer):
+    server_messaging = ServerMessaging()
+
+    def send_message(message):
+        tracing.stamp('send_message')
+        tracing.finish()
+
+    server_messaging.server_register_callback('send_message', send_message)
+    server_messaging.gui_register_callbacks(
+        'received', lambda message: server_messaging.gui_post('send_message', message))
+
+    # The first message is sampled, the span travels through both queues
+    tracing.begin()
+    server_messaging.server_post('received', 'A')
+    tracing.activate(None)
+
+    server_messaging.gui_check()
+    server_messaging.server_check()
+
+    span, = tracer.spans
+    assert [stage for stage, _ in span.stamps] == [
+        'start', 'server_post', 'gui_check', 'gui_post', 'server_check',
+        'send_message']
+
+
+def test_batch_is_traced(tracer):
+    server_messaging = ServerMessaging()
+
+    def send_messages(messages):
+        tracing.stamp('send_message')
+        tracing.finish()
+
+    server_messaging.server_register_callback('send_messages', send_messages)
+    server_messaging.gui_register_batch_callbacks(
+        'received', lambda messages: server_messaging.gui_post('send_messages', messages))
+
+    # Every second message is sampled, all sampled spans of the batch finish
+    for message in 'ABCD':
+        tracing.begin()
+        server_messaging.server_post('received', message)
+        tracing.activate(None)
+
+    server_messaging.gui_check()
+    server_messaging.server_check()
+
+    assert len(tracer.spans) == 2
+    for span in tracer.spans:
+        assert [stage for stage, _ in span.stamps] == [
+            'start', 'server_post', 'gui_check', 'gui_post', 'server_check',
+            'send_message']
+    assert sum(tracer.histograms['send_message'].values()) == 2